@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2005-2008  Dustin Sallings <dustin@spy.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# <http://www.opensource.org/licenses/mit-license.php>
+"""
+Record github traffic to a file and play it back without a network.
+
+A cassette is a file with one JSON object per line, each describing
+a request and the response it got.  Tokens are masked before anything
+is written.
+"""
+
+import re
+import time
+import base64
+import threading
+
+try: import simplejson as json
+except ImportError: import json
+
+import hclient
+
+_SECRET = re.compile(r'(^|&|\?)(token|password)=[^&]*')
+
+def _scrub(s):
+    if s is None:
+        return None
+    return _SECRET.sub(r'\1\2=SECRET', s)
+
+def _key(url, data, method):
+    if not method:
+        method = data is None and 'GET' or 'POST'
+    return method, _scrub(url), _scrub(data)
+
+class CassetteMiss(LookupError):
+    """Raised when replaying a request that was never recorded."""
+
+class RecordingFetcher(object):
+    """A fetcher that appends every exchange to a cassette file."""
+
+    def __init__(self, path, fetcher=hclient.fetch):
+        self.path = path
+        self.fetcher = fetcher
+        self._lock = threading.Lock()
+
+    def _record(self, url, data, method, code, headers, body, elapsed):
+        method, url, data = _key(url, data, method)
+        line = json.dumps({'method': method, 'url': url, 'data': data,
+                           'status': code,
+                           'headers': dict(headers.items()),
+                           'body': base64.b64encode(body),
+                           'elapsed': elapsed})
+        self._lock.acquire()
+        try:
+            f = open(self.path, 'a')
+            try:
+                f.write(line + '\n')
+            finally:
+                f.close()
+        finally:
+            self._lock.release()
+
+    def __call__(self, url, data=None, **kwargs):
+        start = time.time()
+        try:
+            resp = hclient.buffered(self.fetcher(url, data, **kwargs), url)
+        except hclient.HTTPError as e:
+            body = e.read()
+            self._record(url, data, kwargs.get('method'), e.code,
+                         e.info() or {}, body, time.time() - start)
+            raise hclient.HTTPError(url, e.code, e.msg, e.info(),
+                                    hclient.StringIO(body))
+        self._record(url, data, kwargs.get('method'), resp.code,
+                     resp.headers, resp.body, time.time() - start)
+        return resp
+
+class ReplayFetcher(object):
+    """A fetcher answering from a cassette.
+
+    Identical requests are answered in the order they were recorded,
+    the last answer repeating once they run out.  Each answer can be
+    delayed by latency seconds plus its size divided by bandwidth
+    (bytes per second) to simulate a network."""
+
+    def __init__(self, path, latency=0, bandwidth=None, sleep=time.sleep):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._exchanges = {}
+        f = open(path)
+        try:
+            for line in f:
+                if not line.strip():
+                    continue
+                e = json.loads(line)
+                k = (e['method'], e['url'], e['data'])
+                self._exchanges.setdefault(k, []).append(e)
+        finally:
+            f.close()
+
+    def _next(self, key):
+        self._lock.acquire()
+        try:
+            queue = self._exchanges.get(key)
+            if not queue:
+                raise CassetteMiss(' '.join(k for k in key if k))
+            if len(queue) > 1:
+                return queue.pop(0)
+            return queue[0]
+        finally:
+            self._lock.release()
+
+    def __call__(self, url, data=None, method=None, **kwargs):
+        e = self._next(_key(url, data, method))
+        body = base64.b64decode(e['body'])
+
+        delay = self.latency
+        if self.bandwidth:
+            delay += len(body) / float(self.bandwidth)
+        if delay:
+            self._sleep(delay)
+
+        if e['status'] >= 400:
+            raise hclient.HTTPError(url, e['status'], '', e['headers'],
+                                    hclient.StringIO(body))
+        return hclient.BufferedResponse(url, body, e['headers'], e['status'])
@@ -43,18 +43,21 @@ def printFooter():
 </html>"""
 
 def usage():
-    sys.stderr.write("Usage:  %s githubuser githubtoken > map.html\n"
-                     % sys.argv[0])
+    sys.stderr.write("Usage:  %s githubuser githubtoken [concurrency]"
+                     " > map.html\n" % sys.argv[0])
     sys.exit(64)
 
 if __name__ == '__main__':
 
     try:
         gh = github.GitHub(sys.argv[1], sys.argv[2])
-    except IndexError:
+        concurrency = int((sys.argv[3:] or [10])[0])
+    except (IndexError, ValueError):
         usage()
 
-    rh = gh.repos.collaborators_all()
+    rh = gh.repos.collaborators_all(concurrency=concurrency)
+    for r, e in sorted(rh.errors.items()):
+        sys.stderr.write("Couldn't get collaborators of %s: %s\n" % (r, e))
 
     allusers = set()
     for v in rh.itervalues():
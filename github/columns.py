@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2005-2008  Dustin Sallings <dustin@spy.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# <http://www.opensource.org/licenses/mit-license.php>
+"""
+Turn lists of responses into typed columns for analysis.
+
+    import columns
+    cols = columns.columns(gh.repos.forUser('dustin'))
+    print sum(cols['watchers']), cols['owner'].values
+
+Numbers and booleans become numpy arrays (or array.array if numpy
+isn't installed), timestamps become seconds since the epoch, and
+strings are dictionary encoded.  Columns with missing values are
+floats, with NaN where the value is missing.
+"""
+
+import array
+import datetime
+
+try: import numpy
+except ImportError: numpy = None
+
+import dates
+
+class DictColumn(object):
+    """A dictionary encoded column of strings.
+
+    values holds each distinct string once, and codes holds the index
+    into values of each row's string, or -1 where it's missing."""
+
+    def __init__(self, codes, values):
+        self.codes = codes
+        self.values = values
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        code = self.codes[i]
+        if code < 0:
+            return None
+        return self.values[code]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return "<<DictColumn of %d rows, %d values>>" % (len(self),
+                                                          len(self.values))
+
+def _array(kind, values):
+    if kind == 'object':
+        if numpy is not None:
+            rv = numpy.empty(len(values), dtype=object)
+            rv[:] = values
+            return rv
+        return values
+    if None in values:
+        nan = float('nan')
+        values = [v is None and nan or v for v in values]
+        kind = 'float'
+    if numpy is not None:
+        return numpy.array(values, dtype={'int': numpy.int64,
+                                          'date': numpy.int64,
+                                          'bool': numpy.bool_,
+                                          'float': numpy.float64,
+                                          'code': numpy.int32}[kind])
+    return array.array({'int': 'l', 'date': 'l', 'bool': 'b', 'float': 'd',
+                        'code': 'i'}[kind], values)
+
+class _Column(object):
+    """Values of one field, converted as they're added."""
+
+    def __init__(self, name, rows):
+        self.name = name
+        # One of int, float, bool, date, str or object once a value
+        # has been seen.
+        self.kind = None
+        self.values = [None] * rows
+        self.codes = {}
+        self.strings = []
+        self.isDate = name.endswith('_at') or name.endswith('_date')
+
+    def _kindOf(self, v):
+        if isinstance(v, bool):
+            return 'bool'
+        if isinstance(v, (int, long)):
+            return 'int'
+        if isinstance(v, float):
+            return 'float'
+        if isinstance(v, datetime.datetime):
+            return 'date'
+        if isinstance(v, basestring):
+            if self.isDate:
+                try:
+                    dates.parse(v)
+                    return 'date'
+                except ValueError:
+                    pass
+            return 'str'
+        return 'object'
+
+    def _becomeObjects(self):
+        if self.kind == 'str':
+            strings = self.strings
+            self.values = [None if c is None else strings[c]
+                           for c in self.values]
+        self.kind = 'object'
+
+    def add(self, v):
+        if v is None:
+            self.values.append(None)
+            return
+        kind = self._kindOf(v)
+        if self.kind is None:
+            self.kind = kind
+        elif kind != self.kind:
+            if (set([kind, self.kind]) <= set(['int', 'float'])):
+                self.kind = 'float'
+            elif self.kind != 'object':
+                self._becomeObjects()
+
+        if self.kind == 'str':
+            code = self.codes.get(v)
+            if code is None:
+                code = self.codes[v] = len(self.strings)
+                self.strings.append(v)
+            v = code
+        elif self.kind == 'date':
+            v = int(dates.epoch(v))
+        self.values.append(v)
+
+    def build(self):
+        if self.kind == 'str':
+            return DictColumn(_array('code', [c is None and -1 or c
+                                              for c in self.values]),
+                              self.strings)
+        return _array(self.kind or 'object', self.values)
+
+def _get(item, field):
+    for name in field.split('.'):
+        item = getattr(item, name, None)
+        if item is None:
+            break
+    return item
+
+class ColumnBuilder(object):
+    """Collects responses into columns, one at a time.
+
+    With no fields given, every field of every response gets a column;
+    otherwise only the named ones do, and a name may reach into nested
+    responses (e.g. 'author.login').  Only the named fields of lazily
+    built responses get converted."""
+
+    def __init__(self, fields=None):
+        self.fields = fields
+        self.rows = 0
+        self._columns = {}
+        for f in fields or []:
+            self._columns[f] = _Column(f, 0)
+
+    def add(self, item):
+        if self.fields is None:
+            values = item._asdict()
+            for k in values:
+                if k not in self._columns:
+                    self._columns[k] = _Column(k, self.rows)
+            for k, col in self._columns.iteritems():
+                col.add(values.get(k))
+        else:
+            for f in self.fields:
+                self._columns[f].add(_get(item, f))
+        self.rows += 1
+
+    def extend(self, items):
+        for item in items:
+            self.add(item)
+
+    def build(self):
+        """A dict of the columns, by field name."""
+        return dict((k, c.build()) for k, c in self._columns.iteritems())
+
+def columns(items, fields=None):
+    """Columns of the given fields of the given responses.
+
+    items may be any iterable, including the iterators returned when
+    streaming, in which case responses are added as they're parsed."""
+    b = ColumnBuilder(fields)
+    b.extend(items)
+    return b.build()
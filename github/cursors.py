@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2005-2008  Dustin Sallings <dustin@spy.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# <http://www.opensource.org/licenses/mit-license.php>
+"""
+Remember the newest commit seen on each branch between runs.
+
+    import cursors
+    store = cursors.CursorStore('commits.state')
+    for c in cursors.sync(gh, store, 'dustin', 'py-github'):
+        print c.id
+
+Only the pages of history newer than the last run are fetched.
+"""
+
+import os
+import tempfile
+import threading
+
+try: import simplejson as json
+except ImportError: import json
+
+def _key(user, repo, branch):
+    return '/'.join([user, repo, branch])
+
+class CursorStore(object):
+    """The last seen sha of each branch, kept in a JSON file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._cursors = {}
+        if os.path.exists(path):
+            f = open(path)
+            try:
+                self._cursors = json.load(f)
+            finally:
+                f.close()
+
+    def get(self, user, repo, branch='master'):
+        """The sha last seen on the branch, or None."""
+        return self._cursors.get(_key(user, repo, branch))
+
+    def set(self, user, repo, branch, sha):
+        """Record sha as the last seen on the branch, saving the store."""
+        self._lock.acquire()
+        try:
+            self._cursors[_key(user, repo, branch)] = sha
+            self._save()
+        finally:
+            self._lock.release()
+
+    def _save(self):
+        # Write a new file and move it over the old one, so a crash
+        # never leaves a half written store.
+        d = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=d)
+        try:
+            f = os.fdopen(fd, 'w')
+            try:
+                json.dump(self._cursors, f, sort_keys=True, indent=1)
+            finally:
+                f.close()
+            os.rename(tmp, self.path)
+        except Exception:
+            os.unlink(tmp)
+            raise
+
+def sync(gh, store, user, repo, branch='master'):
+    """The commits on a branch since the last sync, newest first.
+
+    The store's cursor only moves once they've all been fetched."""
+    commits = gh.commits.forBranchSince(user, repo, branch,
+                                        store.get(user, repo, branch))
+    if commits:
+        store.set(user, repo, branch, commits[0].id)
+    return commits
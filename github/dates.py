@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2005-2008  Dustin Sallings <dustin@spy.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# <http://www.opensource.org/licenses/mit-license.php>
+"""
+Fast parsing of the timestamps github sends.
+"""
+
+import array
+import datetime
+
+class FixedOffset(datetime.tzinfo):
+    """A timezone a fixed number of minutes east of UTC."""
+
+    def __init__(self, minutes):
+        self.minutes = minutes
+        self._offset = datetime.timedelta(minutes=minutes)
+
+    def utcoffset(self, dt):
+        return self._offset
+
+    def dst(self, dt):
+        return datetime.timedelta(0)
+
+    def tzname(self, dt):
+        sign = self.minutes < 0 and '-' or '+'
+        return '%s%02d:%02d' % ((sign,) + divmod(abs(self.minutes), 60))
+
+    def __reduce__(self):
+        return offset, (self.minutes,)
+
+    def __repr__(self):
+        return '<FixedOffset %s>' % self.tzname(None)
+
+_offsets = {}
+
+def offset(minutes):
+    """The (shared) FixedOffset for the given minutes east of UTC."""
+    rv = _offsets.get(minutes)
+    if rv is None:
+        rv = _offsets.setdefault(minutes, FixedOffset(minutes))
+    return rv
+
+UTC = offset(0)
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=UTC)
+
+# Parsed timestamps, since the same ones tend to come up over and over.
+CACHE_SIZE = 65536
+_cache = {}
+
+def _zone(s):
+    """Minutes east of UTC for Z, +HH:MM, +HHMM or +HH."""
+    if s in ('Z', 'z', ''):
+        return 0
+    if s[0] not in '+-' or len(s) not in (3, 5, 6):
+        raise ValueError("Bad timezone: %r" % s)
+    minutes = int(s[1:3]) * 60 + int(s[-2:] if len(s) > 3 else 0)
+    if s[0] == '-':
+        minutes = -minutes
+    return minutes
+
+def _parse(s):
+    # 2009-04-17T16:19:02-07:00, 2011-04-05T06:29:29Z or
+    # 2009/04/17 16:19:02 -0700
+    if len(s) < 19 or s[4] not in '-/' or s[7] != s[4] or s[10] not in 'T ':
+        raise ValueError("Unknown timestamp format: %r" % s)
+    rest = s[19:]
+    micros = 0
+    if rest.startswith('.'):
+        end = 1
+        while end < len(rest) and rest[end].isdigit():
+            end += 1
+        micros = int((rest[1:end] + '000000')[:6])
+        rest = rest[end:]
+    return datetime.datetime(int(s[0:4]), int(s[5:7]), int(s[8:10]),
+                             int(s[11:13]), int(s[14:16]), int(s[17:19]),
+                             micros, offset(_zone(rest.strip())))
+
+def parse(s):
+    """Parse a github timestamp into a timezone aware datetime.
+
+    Raises ValueError for anything that doesn't look like one."""
+    rv = _cache.get(s)
+    if rv is None:
+        rv = _parse(s)
+        if len(_cache) >= CACHE_SIZE:
+            _cache.clear()
+        _cache[s] = rv
+    return rv
+
+def epoch(dt):
+    """Seconds since the epoch of a datetime (UTC if it's naive) or
+    timestamp string."""
+    if isinstance(dt, basestring):
+        dt = parse(dt)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=UTC)
+    d = dt - EPOCH
+    return d.days * 86400 + d.seconds + d.microseconds / 1e6
+
+def epochs(items, field):
+    """An array of the epoch seconds of the given field of each item.
+
+    Items without the field (or with it set to None) get NaN."""
+    nan = float('nan')
+    rv = array.array('d')
+    for item in items:
+        v = getattr(item, field, None)
+        rv.append(v is None and nan or epoch(v))
+    return rv
@@ -47,4 +47,4 @@ if __name__ == '__main__':
         try:
             print "Found %s at %s" % (repo.name, mk_url(repo))
         except AttributeError:
-            print "Bug: Couldn't format %s" % repo.__dict__
+            print "Bug: Couldn't format %s" % repo._asdict()
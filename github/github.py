@@ -36,36 +36,111 @@ See the GitHub docs or README.markdown for more usage.
 Copyright (c) 2007  Dustin Sallings <dustin@spy.net>
 """
 
+import re
 import sys
+import base64
+import collections
+import copy
+import time
+import inspect
+import threading
+import contextlib
 import xml
 import xml.dom.minidom
+import xml.parsers.expat
 
 try: import simplejson as json
 except ImportError: import json
 
+# v3 responses are all JSON, so use the quickest decoder available.
+try: from ujson import loads as _json_loads
+except ImportError: _json_loads = json.loads
+
+
 from urllib import urlencode
 
+import dates
 import hclient
+import workers
 
-def _string_parser(x):
+# Every parser takes an element and the type mappings in effect for
+# the call it's parsing.
+
+def _string_parser(x, types=None):
     """Extract the data from the first child of the input."""
     return x.firstChild.data
 
+def _int_parser(x, types=None):
+    return int(_string_parser(x))
+
+def _float_parser(x, types=None):
+    return float(_string_parser(x))
+
+def _bool_parser(x, types=None):
+    return _string_parser(x) == 'true'
+
+def _datetime_parser(x, types=None):
+    return dates.parse(_string_parser(x))
+
 _types = {
     'string': _string_parser,
-    'integer': lambda x: int(_string_parser(x)),
-    'float': lambda x: float(_string_parser(x)),
+    'integer': _int_parser,
+    'float': _float_parser,
     'datetime': _string_parser,
-    'boolean': lambda x: _string_parser(x) == 'true'
+    'boolean': _bool_parser
 }
 
-def _parse(el):
+# How the streaming parser converts the text of elements handled by
+# each of the simple parsers above.
+_text_converters = {
+    _string_parser: lambda s: s,
+    _int_parser: int,
+    _float_parser: float,
+    _bool_parser: lambda s: s == 'true',
+    _datetime_parser: dates.parse,
+}
+
+# Mappings that turn timestamps into datetimes, for endpoints asked to.
+_DATE_TYPES = {
+    'datetime': _datetime_parser,
+    'authored-date': _datetime_parser,
+    'committed-date': _datetime_parser,
+}
+
+# Type tables with _DATE_TYPES added: id(types) -> (types, dated).
+_dated = {}
+
+def _withDates(types):
+    rv = _dated.get(id(types))
+    if rv is None or rv[0] is not types:
+        merged = types.copy()
+        merged.update(_DATE_TYPES)
+        rv = _dated[id(types)] = (types, merged)
+    return rv[1]
+
+def _v3Dates(doc):
+    """Parse the timestamps in a decoded v3 document, in place."""
+    if isinstance(doc, list):
+        for v in doc:
+            _v3Dates(v)
+    elif isinstance(doc, dict):
+        for k, v in doc.iteritems():
+            if isinstance(v, basestring):
+                if k.endswith('_at') or k == 'date':
+                    doc[k] = dates.parse(v)
+            elif v:
+                _v3Dates(v)
+    return doc
+
+def _parse(el, types=None):
     """Generic response parser."""
 
+    if types is None:
+        types = _types
     type = 'string'
     if el.attributes and 'type' in list(el.attributes.keys()):
         type = el.attributes['type'].value
-    elif el.localName in _types:
+    elif el.localName in types:
         type = el.localName
     elif len(el.childNodes) > 1:
         # This is a container, find the child type
@@ -78,9 +153,9 @@ def _parse(el):
 
     if not type:
         raise Exception("Can't parse %s, known: %s"
-                        % (el.toxml(), repr(list(_types.keys()))))
+                        % (el.toxml(), repr(list(types.keys()))))
 
-    return _types[type](el)
+    return types[type](el, types)
 
 def parses(t):
     """Parser for a specific type in the github response."""
@@ -90,51 +165,225 @@ def parses(t):
     return f
 
 def with_temporary_mappings(m):
-    """Allow temporary localized altering of type mappings."""
+    """Allow temporary localized altering of type mappings.
+
+    The altered mappings are worked out once, and only apply to the
+    decorated call, so other threads parsing at the same time aren't
+    affected."""
     def f(orig):
-        def every(self, *args):
-            global _types
-            o = _types.copy()
-            for k,v in list(m.items()):
-                if v:
-                    _types[k] = v
-                else:
-                    del _types[k]
-            try:
-                return orig(self, *args)
-            finally:
-                _types = o
+        types = _types.copy()
+        for k,v in list(m.items()):
+            if v:
+                types[k] = v
+            else:
+                del types[k]
+        def every(self, *args, **kwargs):
+            return orig(self._withTypes(types), *args, **kwargs)
+        every.__name__ = orig.__name__
+        every.__doc__ = orig.__doc__
         return every
     return f
 
+# The public endpoint calls running in each thread, innermost last, as
+# (endpoint name, [(argument name, value), ...]).
+_calls = threading.local()
+
+def traced(orig):
+    """Name the events of requests the decorated endpoint method makes.
+
+    While it runs, its requests are reported as made by it, with its
+    arguments standing in for their values in the URL template."""
+    spec = inspect.getargspec(orig)
+    names = spec.args[1:]
+    defaults = dict(zip(reversed(names), reversed(spec.defaults or ())))
+    def f(self, *args, **kwargs):
+        given = dict(defaults)
+        given.update(zip(names, args))
+        given.update(kwargs)
+        stack = getattr(_calls, 'stack', None)
+        if stack is None:
+            stack = _calls.stack = []
+        stack.append((self.__class__.__name__ + '.' + orig.__name__,
+                      [(n, given.get(n)) for n in names]))
+        try:
+            return orig(self, *args, **kwargs)
+        finally:
+            stack.pop()
+    f.__name__ = orig.__name__
+    f.__doc__ = orig.__doc__
+    return f
+
+def _template(path, args):
+    """path with each argument's value replaced by :name.
+
+    A query value is taken to be the argument named like its key, if
+    there is one.  Other arguments are matched to the remaining
+    segments in order, so equal values still get their own names."""
+    values = [(n, str(v), hclient.quote_plus(str(v))) for n, v in args
+              if isinstance(v, (basestring, int, long))]
+    tokens = re.split(r'([/?&=])', path)
+    rv = [None] * len(tokens)
+    for i in range(2, len(tokens)):
+        if tokens[i - 1] == '=':
+            for j, (n, plain, quoted) in enumerate(values):
+                if n == tokens[i - 2] and tokens[i] in (plain, quoted):
+                    rv[i] = ':' + n
+                    del values[j]
+                    break
+    for i, t in enumerate(tokens):
+        if rv[i] is not None:
+            continue
+        rv[i] = t
+        for j, (n, plain, quoted) in enumerate(values):
+            if t and t in (plain, quoted):
+                rv[i] = ':' + n
+                del values[j]
+                break
+    return ''.join(rv)
+
 @parses('array')
-def _parseArray(el):
+def _parseArray(el, types=None):
     rv = []
     ch = el.firstChild
     while ch:
         if ch.nodeType != xml.dom.Node.TEXT_NODE and ch.firstChild:
-            rv.append(_parse(ch))
+            rv.append(_parse(ch, types))
         ch=ch.nextSibling
     return rv
 
+def _parseFirst(el, types=None):
+    """Parse an element wrapping a single value."""
+    return _parseArray(el, types)[0]
+
+class InternPool(object):
+    """Shares one string object among equal strings.
+
+    At most maxSize distinct strings are kept; once it's full, strings
+    not already in the pool are returned as they are."""
+
+    def __init__(self, maxSize=None):
+        self.maxSize = maxSize
+        self._values = {}
+
+    def __len__(self):
+        return len(self._values)
+
+    def intern(self, s):
+        rv = self._values.get(s)
+        if rv is None:
+            if self.maxSize is not None and len(self._values) >= self.maxSize:
+                return s
+            rv = self._values.setdefault(s, s)
+        return rv
+
 class BaseResponse(object):
-    """Base class for XML Response Handling."""
+    """Base class for XML Response Handling.
+
+    Subclasses declare the fields they expect in __slots__; any other
+    field github sends lands in the instance's __dict__."""
+
+    __slots__ = ('__dict__', '__weakref__', '_raw')
 
-    def __init__(self, el):
+    # Fields likely to hold the same value across many responses, which
+    # are shared through an InternPool when one is in use.
+    _interned = frozenset()
+
+    def __init__(self, el, types=None):
         ch = el.firstChild
         while ch:
             if ch.nodeType != xml.dom.Node.TEXT_NODE and ch.firstChild:
                 ln = ch.localName.replace('-', '_')
-                self.__dict__[ln] = _parse(ch)
+                setattr(self, ln, _parse(ch, types))
             ch=ch.nextSibling
 
+    @classmethod
+    def _fromPairs(cls, pairs):
+        """Build from (element name, parsed value) pairs."""
+        rv = cls.__new__(cls)
+        for name, value in pairs:
+            setattr(rv, name.replace('-', '_'), value)
+        return rv
+
+    def __getattr__(self, name):
+        # Lazily built responses convert each field when it's first used.
+        if name == '_raw' or name.startswith('__'):
+            raise AttributeError(name)
+        try:
+            raw = object.__getattribute__(self, '_raw')
+        except AttributeError:
+            raw = None
+        if raw is None:
+            raise AttributeError(name)
+        return self._load(raw, name)
+
+    def _load(self, raw, name):
+        v = raw.value(name)
+        if raw.pool is not None and name in self._interned:
+            v = raw.pool.intern(v)
+        setattr(self, name, v)
+        return v
+
+    def _intern(self, pool):
+        """Replace interned fields with their values from the pool."""
+        for k in self._interned:
+            try:
+                v = object.__getattribute__(self, k)
+            except AttributeError:
+                continue
+            if isinstance(v, basestring):
+                setattr(self, k, pool.intern(v))
+
+    def _materialize(self):
+        """Convert any fields of a lazily built response not yet used."""
+        raw = getattr(self, '_raw', None)
+        if raw is None:
+            return
+        for k in raw.attrs():
+            try:
+                object.__getattribute__(self, k)
+            except AttributeError:
+                try:
+                    self._load(raw, k)
+                except AttributeError:
+                    pass
+        self._raw = None
+
+    def _asdict(self):
+        """The fields of this response as a dict."""
+        self._materialize()
+        rv = {}
+        for c in type(self).__mro__:
+            for k in c.__dict__.get('__slots__', ()):
+                if (k not in ('__dict__', '__weakref__', '_raw')
+                    and hasattr(self, k)):
+                    rv[k] = getattr(self, k)
+        rv.update(self.__dict__)
+        return rv
+
+    def __getstate__(self):
+        return self._asdict()
+
+    def __setstate__(self, state):
+        for k, v in state.items():
+            setattr(self, k, v)
+
     def __repr__(self):
         return "<<%s>>" % str(self.__class__)
 
 class User(BaseResponse):
     """A github user."""
 
+    __slots__ = ('actions', 'blog', 'collaborators', 'company', 'created',
+                 'created_at', 'disk_usage', 'email', 'followers',
+                 'followers_count', 'following_count', 'fullname',
+                 'gravatar_id', 'id', 'language', 'location', 'login', 'name',
+                 'owned_private_repo_count', 'plan', 'private_gist_count',
+                 'public_gist_count', 'public_repo_count', 'pushed', 'repos',
+                 'score', 'total_private_repo_count', 'type', 'username')
+
     parses = 'user'
+    _interned = frozenset(['blog', 'company', 'email', 'language', 'location',
+                           'login', 'name', 'type', 'username'])
 
     def __repr__(self):
         return "<<User %s>>" % self.name
@@ -142,7 +391,10 @@ class User(BaseResponse):
 class Plan(BaseResponse):
     """A github plan."""
 
+    __slots__ = ('collaborators', 'name', 'private_repos', 'space')
+
     parses = 'plan'
+    _interned = frozenset(['name'])
 
     def __repr__(self):
         return "<<Plan %s>>" % self.name
@@ -150,7 +402,16 @@ class Plan(BaseResponse):
 class Repository(BaseResponse):
     """A repository."""
 
+    __slots__ = ('actions', 'created', 'created_at', 'description',
+                 'followers', 'fork', 'forks', 'has_downloads', 'has_issues',
+                 'has_wiki', 'homepage', 'id', 'integrate_branch', 'language',
+                 'master_branch', 'name', 'open_issues', 'organization',
+                 'owner', 'permission', 'private', 'pushed', 'pushed_at',
+                 'score', 'size', 'type', 'url', 'username', 'watchers')
+
     parses = 'repository'
+    _interned = frozenset(['language', 'organization', 'owner', 'type',
+                           'username'])
 
     @property
     def owner_name(self):
@@ -165,6 +426,9 @@ class Repository(BaseResponse):
 class PublicKey(BaseResponse):
     """A public key."""
 
+    # title has a class default, so it can't also be a slot.
+    __slots__ = ('id', 'key')
+
     parses = 'public-key'
     title = 'untitled'
 
@@ -174,7 +438,12 @@ class PublicKey(BaseResponse):
 class Commit(BaseResponse):
     """A commit."""
 
+    __slots__ = ('author', 'authored_date', 'committed_date', 'committer',
+                 'id', 'message', 'parents', 'tree', 'url', 'added',
+                 'removed', 'modified')
+
     parses = 'commit'
+    _interned = frozenset(['authored_date', 'committed_date'])
 
     def __repr__(self):
         return "<<Commit: %s>>" % self.id
@@ -182,22 +451,32 @@ class Commit(BaseResponse):
 class Parent(Commit):
     """A commit parent."""
 
+    __slots__ = ()
+
     parses = 'parent'
 
 class Author(User):
     """A commit author."""
 
+    __slots__ = ()
+
     parses = 'author'
 
 class Committer(User):
     """A commit committer."""
 
+    __slots__ = ()
+
     parses = 'committer'
 
 class Issue(BaseResponse):
     """An issue within the issue tracker."""
 
+    __slots__ = ('body', 'closed_at', 'created_at', 'labels', 'number',
+                 'position', 'state', 'title', 'updated_at', 'user', 'votes')
+
     parses = 'issue'
+    _interned = frozenset(['state', 'user'])
 
     def __repr__(self):
         return "<<Issue #%d>>" % self.number
@@ -205,14 +484,22 @@ class Issue(BaseResponse):
 class IssueComment(BaseResponse):
     """ An issue comment within the issue tracker."""
 
+    __slots__ = ('body', 'created_at', 'gravatar_id', 'id', 'updated_at',
+                 'user')
+
     parses = 'comment'
+    _interned = frozenset(['gravatar_id', 'user'])
 
     def __repr__(self):
         return "<<Comment #%s>>" % self.body
 
 class Label(BaseResponse):
     """A Label within the issue tracker."""
+
+    __slots__ = ('name',)
+
     parses = 'label'
+    _interned = frozenset(['name'])
 
     def __repr__(self):
         return "<<Label $%s>>" % self.name
@@ -220,6 +507,10 @@ class Label(BaseResponse):
 class Tree(BaseResponse):
     """A Tree object."""
 
+    __slots__ = ('mode', 'name', 'sha', 'type')
+
+    _interned = frozenset(['mode', 'type'])
+
     # Parsing is scoped to objects...
     def __repr__(self):
         return "<<Tree: %s>>" % self.name
@@ -227,6 +518,10 @@ class Tree(BaseResponse):
 class Blob(BaseResponse):
     """A Blob object."""
 
+    __slots__ = ('data', 'mime_type', 'mode', 'name', 'sha', 'size')
+
+    _interned = frozenset(['mime_type', 'mode'])
+
     # Parsing is scoped to objects...
     def __repr__(self):
         return "<<Blob: %s>>" % self.name
@@ -234,6 +529,8 @@ class Blob(BaseResponse):
 class Modification(BaseResponse):
     """A modification object."""
 
+    __slots__ = ('diff', 'filename')
+
     # Parsing is scoped to usage
     def __repr__(self):
         return "<<Modification of %s>>" % self.filename
@@ -241,7 +538,11 @@ class Modification(BaseResponse):
 class Network(BaseResponse):
     """A network entry."""
 
+    __slots__ = ('description', 'fork', 'forks', 'homepage', 'name', 'owner',
+                 'private', 'url', 'watchers')
+
     parses = 'network'
+    _interned = frozenset(['owner'])
 
     def __repr__(self):
         return "<<Network of %s/%s>>" % (self.owner, self.name)
@@ -249,7 +550,13 @@ class Network(BaseResponse):
 class Organization(BaseResponse):
     """An organization."""
 
+    __slots__ = ('billing_email', 'blog', 'company', 'created_at', 'email',
+                 'followers_count', 'following_count', 'gravatar_id', 'id',
+                 'location', 'login', 'name', 'public_gist_count',
+                 'public_repo_count', 'type')
+
     parses = 'organization'
+    _interned = frozenset(['location', 'type'])
 
     def __repr__(self):
         return "<<Organization %s>>" % getattr(self, 'name', self.login)
@@ -258,18 +565,686 @@ class Organization(BaseResponse):
 for __t in (t for t in list(globals().values()) if hasattr(t, 'parses')):
     _types[__t.parses] = __t
 
+class _Failure(object):
+    """An error building a value, raised only if the value gets used."""
+
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+def _resolved(v):
+    if isinstance(v, _Failure):
+        raise v.exc_info[0], v.exc_info[1], v.exc_info[2]
+    return v
+
+class _Element(object):
+    """What the streaming parser needs to know about an open element."""
+
+    __slots__ = ('name', 'type', 'build', 'nodes', 'text', 'lastText',
+                 'children', 'failed', 'typeText')
+
+    def __init__(self, name, type, build):
+        self.name = name
+        self.type = type
+        # The compiled builder for this element, or None if it has to
+        # be worked out from the element's content.
+        self.build = build
+        # The number of DOM child nodes, and the text of the first one
+        # if it's text.
+        self.nodes = 0
+        self.text = None
+        self.lastText = False
+        # (name, value) of each non-empty child element, and whether
+        # any of them is a _Failure.
+        self.children = []
+        self.failed = False
+        # The text of the first <type> child.
+        self.typeText = None
+
+def _streamable(types):
+    """Whether the streaming parser knows every parser in types."""
+    for h in types.values():
+        if not (h in _text_converters or h in (_parseArray, _parseFirst)
+                or (isinstance(h, type) and issubclass(h, BaseResponse))):
+            return False
+    return True
+
+def _children(e):
+    """The values of an element's children, raising any failure."""
+    if e.failed:
+        return [_resolved(v) for n, v in e.children]
+    return [v for n, v in e.children]
+
+def _textBuilder(conv):
+    def build(e):
+        if e.text is None:
+            raise AttributeError("<%s> has no text" % e.name)
+        return conv(e.text)
+    build.conv = conv
+    return build
+
+# Untyped elements with a single child node hold a string.
+_plainText = _textBuilder(_text_converters[_string_parser])
+
+def _firstBuilder(e):
+    return _children(e)[0]
+
+# Attribute names for element names, per response class.
+_fieldNames = {}
+
+def _modelBuilder(cls):
+    fields = _fieldNames.setdefault(cls, {})
+    new = cls.__new__
+    def build(e):
+        if e.failed:
+            _children(e)
+        rv = new(cls)
+        for n, v in e.children:
+            a = fields.get(n)
+            if a is None:
+                a = fields[n] = n.replace('-', '_')
+            setattr(rv, a, v)
+        return rv
+    build.model = cls
+    return build
+
+def _compile(types, name, type):
+    """A builder for <name type="type"> elements, or None.
+
+    None means the type depends on the element's content: it's a
+    string unless there's more than a single child node, in which case
+    _StreamParser._build has to look for a <type> child."""
+    if type is None:
+        if name not in types:
+            return None
+        type = name
+    h = types.get(type)
+    if h is None:
+        return None
+    if h in _text_converters:
+        return _textBuilder(_text_converters[h])
+    if h is _parseArray:
+        return _children
+    if h is _parseFirst:
+        return _firstBuilder
+    return _modelBuilder(h)
+
+# Compiled builders per type table: id(types) -> (types, builders).
+_compiled = {}
+
+def _buildersFor(types):
+    rv = _compiled.get(id(types))
+    if rv is None or rv[0] is not types:
+        rv = _compiled[id(types)] = (types, {})
+    return rv[1]
+
+_ENTITY = re.compile(r'&(#x[0-9a-fA-F]+|#[0-9]+|lt|gt|amp|quot|apos);')
+_ENTITIES = {'lt': u'<', 'gt': u'>', 'amp': u'&', 'quot': u'"', 'apos': u"'"}
+
+def _entity(m):
+    e = m.group(1)
+    if e.startswith('#x'):
+        return unichr(int(e[2:], 16))
+    if e.startswith('#'):
+        return unichr(int(e[1:]))
+    return _ENTITIES[e]
+
+def _unescape(s):
+    """The text expat would report for the given element content."""
+    if '\r' in s:
+        s = s.replace(u'\r\n', u'\n').replace(u'\r', u'\n')
+    if '&' in s:
+        s = _ENTITY.sub(_entity, s)
+    return s
+
+# Element names of fields that a class attribute would hide until
+# they're set, per class.
+_shadows = {}
+
+def _shadowing(cls):
+    rv = _shadows.get(cls)
+    if rv is None:
+        slots = set()
+        for c in cls.__mro__:
+            slots.update(c.__dict__.get('__slots__', ()))
+        rv = set()
+        for a in dir(cls):
+            if a not in slots:
+                rv.update([a, a.replace('_', '-')])
+        rv = _shadows[cls] = frozenset(rv)
+    return rv
+
+class _LazyFields(object):
+    """The unconverted fields of a lazily built response.
+
+    data is the response's XML, found at offset base in the document,
+    and fields maps each element name to (type attribute, start, end):
+    the document offsets of the element's start tag and of the end of
+    its content."""
+
+    __slots__ = ('data', 'base', 'fields', 'types', 'encoding', 'pool')
+
+    def __init__(self, data, base, fields, types, encoding, pool=None):
+        self.data = data
+        self.base = base
+        self.fields = fields
+        self.types = types
+        self.encoding = encoding
+        self.pool = pool
+
+    def attrs(self):
+        return [n.replace('-', '_') for n in self.fields]
+
+    def value(self, attr):
+        name = attr
+        f = self.fields.get(name)
+        if f is None and '_' in attr:
+            name = attr.replace('_', '-')
+            f = self.fields.get(name)
+        if f is None:
+            raise AttributeError(attr)
+        type, start, end = f
+        start -= self.base
+        end -= self.base
+        data = self.data
+        content = data[data.index('>', start) + 1:end]
+        if not content:
+            # Empty elements aren't fields.
+            raise AttributeError(attr)
+        builders = _buildersFor(self.types)
+        try:
+            build = builders[name, type]
+        except KeyError:
+            build = builders[name, type] = _compile(self.types, name, type)
+        if '<' not in content:
+            if build is None:
+                return _unescape(content.decode(self.encoding))
+            conv = getattr(build, 'conv', None)
+            if conv is not None:
+                return conv(_unescape(content.decode(self.encoding)))
+        p = _StreamParser(self.types, lazy=True, encoding=self.encoding,
+                          pool=self.pool)
+        p.feed(data[start:data.index('>', end) + 1])
+        return p.close()
+
+class _ItemStream(object):
+    """Yields the items of an array response as they are parsed.
+
+    onClose, if set, is called once the response is used up or the
+    stream is closed."""
+
+    def __init__(self, chunks, parser):
+        self._chunks = chunks
+        self._parser = parser
+        self._ready = collections.deque()
+        self._done = False
+        self.onClose = None
+
+    def __iter__(self):
+        return self
+
+    def _finish(self):
+        self._done = True
+        if self.onClose:
+            self.onClose()
+            self.onClose = None
+
+    def next(self):
+        while not self._ready:
+            try:
+                self._ready.extend(self._parser.takeItems())
+                if self._ready:
+                    break
+                if self._done:
+                    raise StopIteration
+                self._chunks.next()
+            except StopIteration:
+                if self._done:
+                    raise
+                self._finish()
+            except Exception:
+                self._finish()
+                raise
+        return self._ready.popleft()
+
+    def close(self):
+        """Stop reading, closing the response if it wasn't used up."""
+        if self._done:
+            return
+        self._ready.clear()
+        self._chunks.close()
+        self._finish()
+
+    def __del__(self):
+        self.close()
+
+def _feed(resp, parser, event):
+    """Feed a response to a _StreamParser, yielding after each chunk.
+
+    The parser is closed at the end of the response, and the response
+    is closed if the generator is closed before then."""
+    timings = {}
+    if event is not None:
+        timings = event['timings']
+    timings['read'] = timings['parse'] = 0.0
+    size = 0
+    finished = False
+    try:
+        while True:
+            start = time.time()
+            chunk = resp.read(_CHUNK_SIZE)
+            timings['read'] += time.time() - start
+            start = time.time()
+            if not chunk:
+                finished = True
+                parser.close()
+                timings['parse'] += time.time() - start
+                break
+            size += len(chunk)
+            parser.feed(chunk)
+            timings['parse'] += time.time() - start
+            if event is not None:
+                event['bytes'] = size
+            yield
+    finally:
+        if not finished:
+            resp.close()
+
+class _StreamParser(object):
+    """Builds responses straight from expat events.
+
+    This produces the same objects _parse produces from a DOM, but each
+    element is converted as soon as it ends and then thrown away, so
+    the document is never held in memory.  Children are built before
+    their parent's type is known; errors building them are only raised
+    if the parent ends up using them."""
+
+    def __init__(self, types, items=False, lazy=False, encoding=None,
+                 pool=None):
+        self.types = types
+        self.builders = _buildersFor(types)
+        self.stack = []
+        self.root = None
+        # When wanted and the document is an array, its items are
+        # collected here as they end instead of being kept for the end.
+        self.wantItems = items
+        self.items = None
+        # When lazy, responses are built from their XML only as their
+        # fields are used (see _LazyFields), and elements inside them
+        # are merely counted.  buf holds the document from offset
+        # bufStart on, back to the start of the response being read.
+        self.lazy = lazy
+        self.encoding = encoding or 'utf-8'
+        self.buf = ''
+        self.bufStart = 0
+        # The InternPool, if any, for fields of the responses built.
+        self.pool = pool
+        self.parser = xml.parsers.expat.ParserCreate(encoding)
+        self.parser.buffer_text = True
+        self.parser.XmlDeclHandler = self._decl
+        self._watch()
+
+    def _watch(self):
+        self.parser.StartElementHandler = self._start
+        self.parser.EndElementHandler = self._end
+        self.parser.CharacterDataHandler = self._characters
+        self.parser.CommentHandler = self._node
+        self.parser.ProcessingInstructionHandler = self._node
+
+    def _skim(self):
+        self.parser.StartElementHandler = self._skimStart
+        self.parser.EndElementHandler = self._skimEnd
+        self.parser.CharacterDataHandler = None
+        self.parser.CommentHandler = None
+        self.parser.ProcessingInstructionHandler = None
+
+    def feed(self, data):
+        if self.lazy:
+            if isinstance(data, unicode):
+                data = data.encode('utf-8')
+            self.buf += data
+        self.parser.Parse(data, False)
+
+    def close(self):
+        self.parser.Parse('', True)
+        return _resolved(self.root)
+
+    def takeItems(self):
+        """Remove and return the items of an array parsed so far."""
+        rv, self.items = self.items, []
+        return [_resolved(v) for v in rv]
+
+    def _decl(self, version, encoding, standalone):
+        if encoding:
+            self.encoding = encoding
+
+    def _node(self, *args):
+        if self.stack:
+            e = self.stack[-1]
+            e.nodes += 1
+            e.lastText = False
+
+    def _characters(self, data):
+        if not self.stack:
+            return
+        e = self.stack[-1]
+        if e.lastText:
+            if e.nodes == 1:
+                e.text += data
+            return
+        e.nodes += 1
+        e.lastText = True
+        if e.nodes == 1:
+            e.text = data
+
+    def _start(self, name, attrs):
+        type = attrs.get('type')
+        stack = self.stack
+        if stack:
+            e = stack[-1]
+            e.nodes += 1
+            e.lastText = False
+        elif self.wantItems:
+            if self.types.get(type or name) is _parseArray:
+                self.items = []
+        try:
+            build = self.builders[name, type]
+        except KeyError:
+            build = self.builders[name, type] = _compile(self.types, name,
+                                                         type)
+        if self.lazy and getattr(build, 'model', None) is not None:
+            self.lazyStart = (name, build.model, self.parser.CurrentByteIndex)
+            self.depth = 0
+            self.fields = {}
+            self._skim()
+            return
+        stack.append(_Element(name, type, build))
+
+    def _skimStart(self, name, attrs):
+        self.depth += 1
+        if self.depth == 1:
+            self.child = (attrs.get('type'), self.parser.CurrentByteIndex)
+
+    def _skimEnd(self, name):
+        depth = self.depth
+        if not depth:
+            self._lazyEnd(name)
+            return
+        if depth == 1:
+            type, start = self.child
+            self.fields[name] = (type, start, self.parser.CurrentByteIndex)
+        self.depth = depth - 1
+
+    def _lazyEnd(self, name):
+        self._watch()
+        name, cls, start = self.lazyStart
+        end = self.parser.CurrentByteIndex
+        buf, base = self.buf, self.bufStart
+        stop = end
+        if buf.startswith('</', end - base):
+            stop = buf.index('>', end - base) + base + 1
+        data = buf[start - base:stop - base]
+        self.buf = buf[stop - base:]
+        self.bufStart = stop
+
+        raw = _LazyFields(data, start, self.fields, self.types, self.encoding,
+                          self.pool)
+        rv = cls.__new__(cls)
+        rv._raw = raw
+        for n in _shadowing(cls).intersection(self.fields):
+            try:
+                rv._load(raw, n.replace('-', '_'))
+            except AttributeError:
+                pass
+        nodes = end - start > data.index('>') + 1
+        self._add(name, nodes, rv, None)
+
+    def _end(self, name):
+        stack = self.stack
+        e = stack.pop()
+        try:
+            if e.build is not None:
+                v = e.build(e)
+            elif e.nodes > 1:
+                v = self._build(e)
+            else:
+                v = _plainText(e)
+        except Exception:
+            v = _Failure(sys.exc_info())
+        if self.pool is not None and isinstance(v, BaseResponse):
+            v._intern(self.pool)
+        self._add(name, e.nodes, v, e.text)
+
+    def _add(self, name, nodes, v, text):
+        """Hand a built element to whatever it's in."""
+        stack = self.stack
+        if not stack:
+            self.root = v
+            return
+        if not nodes:
+            return
+        if self.items is not None and len(stack) == 1:
+            self.items.append(v)
+            return
+        parent = stack[-1]
+        parent.children.append((name, v))
+        if v.__class__ is _Failure:
+            parent.failed = True
+        if name == 'type' and parent.typeText is None:
+            parent.typeText = text
+
+    def _build(self, e):
+        type = 'string'
+        if e.type is not None:
+            type = e.type
+        elif e.name in self.types:
+            type = e.name
+        elif e.nodes > 1:
+            type = e.typeText
+        if not type:
+            raise Exception("Can't parse <%s>, known: %s"
+                            % (e.name, repr(list(self.types.keys()))))
+
+        h = self.types[type]
+        conv = _text_converters.get(h)
+        if conv:
+            if e.text is None:
+                raise AttributeError("<%s> has no text" % e.name)
+            return conv(e.text)
+        if h is _parseArray or h is _parseFirst:
+            rv = [_resolved(v) for n, v in e.children]
+            if h is _parseFirst:
+                return rv[0]
+            return rv
+        return h._fromPairs((n, _resolved(v)) for n, v in e.children)
+
+def _timed(event, phase, fn, *args):
+    """Call fn, recording how long it took in the event's timings."""
+    if event is None:
+        return fn(*args)
+    start = time.time()
+    try:
+        return fn(*args)
+    finally:
+        event['timings'][phase] = time.time() - start
+
+def _describe(event, resp):
+    """Record what the transport tells us about a response."""
+    if event is not None:
+        event['status'] = getattr(resp, 'code', None)
+        event['cache'] = getattr(resp, 'cache', None)
+        event['timings'].update(getattr(resp, 'timings', {}))
+
+_NEXT_LINK = re.compile(r'<https://api\.github\.com/([^>]*)>\s*;\s*rel="next"')
+
+def _nextLink(resp):
+    """The path of the next page named by a v3 response, if any."""
+    headers = getattr(resp, 'info', lambda: None)()
+    m = headers and _NEXT_LINK.search(headers.get('link') or '')
+    return m and m.group(1) or None
+
+_CHUNK_SIZE = 16384
+
+def _paginate(fetch, page, prefetch):
+    """Yield the items of fetch(page), fetch(page + 1), ... in order.
+
+    Up to prefetch further pages are fetched in the background while
+    the current one is consumed.  Iteration ends at an empty page, or
+    at one shorter than the first (the last page isn't full).  Pages
+    already requested by then can't be called back: they're read in
+    full, releasing their connections, and dropped, so up to prefetch
+    requests are made past the end."""
+    pool = None
+    if prefetch > 0:
+        hclient.allowConnections(prefetch + 1)
+        pool = workers.WorkerPool(prefetch + 1)
+    pending = collections.deque()
+    size = None
+    try:
+        while True:
+            if pool is None:
+                items = list(fetch(page))
+                page += 1
+            else:
+                while len(pending) <= prefetch:
+                    pending.append(pool.submit(lambda n: list(fetch(n)),
+                                               page))
+                    page += 1
+                items = pending.popleft().result()
+            if size is None:
+                size = len(items)
+            for item in items:
+                yield item
+            if not items or len(items) < size:
+                return
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+class DeadlineExceeded(Exception):
+    """Raised when a call runs past its deadline."""
+
+class PartialResult(dict):
+    """Results by key, with the exceptions of the keys that failed in
+    errors."""
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.errors = {}
+
 class BaseEndpoint(object):
 
     BASE_URL = 'https://github.com/api/v2/xml/'
 
-    def __init__(self, user, token, fetcher):
+    # workers.SingleFlight coalescing identical concurrent GETs, if any.
+    flights = None
+    # Absolute time (as from time.time()) by which requests must finish.
+    deadline = None
+    # Callables given an event dict describing each call.
+    sinks = ()
+    # Whether arrays are returned as iterators while they're parsed.
+    streaming = False
+    # Whether response fields are only converted once they're used.
+    lazy = False
+    # True to share equal values of each response's interned fields, or
+    # an InternPool to share them across responses.
+    interning = None
+    # Whether timestamps are parsed into datetimes.
+    dates = False
+    # Type mappings used to parse responses; never modified in place.
+    types = _types
+
+    def __init__(self, user, token, fetcher, **options):
         self.user = user
         self.token = token
         self.fetcher = fetcher
+        self.__dict__.update(options)
+
+    def _withDeadline(self, seconds):
+        """A copy of this endpoint whose requests must finish in seconds."""
+        ep = copy.copy(self)
+        if seconds is not None:
+            ep.deadline = time.time() + seconds
+            if self.deadline is not None:
+                ep.deadline = min(ep.deadline, self.deadline)
+        return ep
+
+    def _withTypes(self, types):
+        """A copy of this endpoint parsing with the given type mappings."""
+        ep = copy.copy(self)
+        ep.types = types
+        return ep
+
+    def _timeout(self):
+        """Fetcher arguments limiting a request to the time left."""
+        if self.deadline is None:
+            return {}
+        remaining = self.deadline - time.time()
+        if remaining <= 0:
+            raise DeadlineExceeded()
+        return {'timeout': remaining}
+
+    def _coalesced(self, key, fn, *args):
+        if self.flights is None:
+            return fn(*args)
+        return self.flights.do(key, fn, *args)
+
+    def _newEvent(self, method, url):
+        """Describe a call for the sinks.
+
+        The public endpoint method being run, if any, names the event
+        and supplies the arguments for the template."""
+        event = {'endpoint': None, 'template': None, 'method': method,
+                 'url': url, 'status': None, 'bytes': None, 'cache': None,
+                 'timings': {}}
+        stack = getattr(_calls, 'stack', None)
+        if not stack:
+            return event
+        event['endpoint'], args = stack[-1]
+        base = ''
+        for b in (self.BASE_URL, 'https://api.github.com/'):
+            if url.startswith(b):
+                base = b
+                break
+        event['template'] = base + _template(url[len(base):], args)
+        return event
+
+    def _instrumented(self, method, url, fn, *args):
+        """Run fn(event, *args), then hand the event to every sink."""
+        event = self._newEvent(method, url)
+        start = time.time()
+        def emit():
+            event['timings']['total'] = time.time() - start
+            for sink in self.sinks:
+                sink(event)
+
+        rv = None
+        try:
+            rv = fn(event, *args)
+            return rv
+        except hclient.HTTPError, e:
+            event['status'] = e.code
+            raise
+        finally:
+            # Streamed arrays are reported once they've been read.
+            if isinstance(rv, _ItemStream):
+                rv.onClose = emit
+            else:
+                emit()
 
-    def _raw_fetch(self, path, base=None, data=None, httpAuth=False, method=None):
+    def _raw_fetch(self, path, base=None, data=None, httpAuth=False, method=None,
+                   event=None, coalesce=True):
         if not base:
             base = self.BASE_URL
+        if event is None and self.sinks:
+            return self._instrumented(method or (data is None and 'GET'
+                                                 or 'POST'),
+                                      base + path, self._request, path,
+                                      base, data, httpAuth, method, coalesce)
+        return self._request(event, path, base, data, httpAuth, method,
+                             coalesce)
+
+    def _request(self, event, path, base, data, httpAuth, method,
+                 coalesce=True):
         p = base + path
         args = ''
         if self.user and self.token and not httpAuth:
@@ -280,15 +1255,36 @@ class BaseEndpoint(object):
             else:
                 p += '?' + params
 
+        kwargs = self._timeout()
         if httpAuth:
-            return self.fetcher(p, data,
-                                username=self.user, password=self.token,
-                                method=method)
+            fetch = lambda: self.fetcher(p, data,
+                                         username=self.user,
+                                         password=self.token,
+                                         method=method, **kwargs)
         else:
-            return self.fetcher(p, data)
+            fetch = lambda: self.fetcher(p, data, **kwargs)
 
-    def _fetch(self, path, parselang = False):
-        rawfetch = self._raw_fetch(path).read()
+        if (self.flights is None or not coalesce or self.streaming
+            or data is not None or method):
+            rv = fetch()
+        else:
+            # Concurrent callers share the body, each reading its own copy.
+            rv = self._coalesced((p, httpAuth and (self.user, self.token)),
+                                 lambda: hclient.buffered(fetch(), p))
+            rv = hclient.BufferedResponse(rv.url, rv.body, rv.headers,
+                                          rv.code, rv.cache, rv.timings)
+        _describe(event, rv)
+        return rv
+
+    def _fetch(self, path, parselang = False, event=None):
+        if event is None and self.sinks:
+            return self._instrumented('GET', self.BASE_URL + path,
+                                      lambda ev: self._fetch(path, parselang,
+                                                             ev))
+        resp = self._raw_fetch(path, event=event)
+        rawfetch = _timed(event, 'read', resp.read)
+        if event is not None:
+            event['bytes'] = len(rawfetch)
         # Hack since Github languages API gives malformed XML
         if parselang:
             rawfetch = rawfetch.replace('#', 'sharp')
@@ -298,69 +1294,185 @@ class BaseEndpoint(object):
             rawfetch = rawfetch.replace('Visual Basic', 'VisualBasic')
             rawfetch = rawfetch.replace('Pure Data', 'PureData')
             rawfetch = rawfetch.replace('Max/MSP', 'MaxMSP')
-        return xml.dom.minidom.parseString(rawfetch)
+        return _timed(event, 'parse', xml.dom.minidom.parseString, rawfetch)
+
+    def _jload(self, event, path, data, httpAuth, links=None):
+        resp = self._raw_fetch(path, 'https://api.github.com/', data=data,
+                               httpAuth=httpAuth, event=event)
+        if links is not None:
+            links.append(_nextLink(resp))
+        body = _timed(event, 'read', resp.read)
+        if event is not None:
+            event['bytes'] = len(body)
+        return _timed(event, 'parse', _json_loads, body)
+
+    def _jcall(self, path, data, httpAuth, links=None):
+        if not self.sinks:
+            return self._jload(None, path, data, httpAuth, links)
+        return self._instrumented(data is None and 'GET' or 'POST',
+                                  'https://api.github.com/' + path,
+                                  self._jload, path, data, httpAuth, links)
 
     def _jfetch(self, path, httpAuth=True):
-        return json.load(self._raw_fetch(path, 'https://api.github.com/',
-                                         httpAuth=httpAuth))
+        return self._jcall(path, None, httpAuth)
 
-    def _jpost(self, path, data, httpAuth=True):
-        return json.load(self._raw_fetch(path, 'https://api.github.com/',
-                                         data=data,
-                                         httpAuth=httpAuth))
+    def _v3get(self, path, **params):
+        """Fetch and decode a v3 document, with the given query."""
+        if params:
+            path += '?' + urlencode(sorted(params.items()))
+        if self.dates:
+            return _v3Dates(self._jfetch(path))
+        return self._jfetch(path)
+
+    def _v3list(self, path, **params):
+        """Fetch and decode a v3 list, a hundred items to a page.
+
+        The given page is fetched if there is one, otherwise every page
+        is, following the Link headers until there's no next one."""
+        params['per_page'] = 100
+        path += '?' + urlencode(sorted(params.items()))
+        rv = []
+        while path:
+            links = []
+            doc = self._jcall(path, None, True, links)
+            if self.dates:
+                _v3Dates(doc)
+            # Search results wrap their list up with a count.
+            if isinstance(doc, dict):
+                doc = doc['items']
+            rv.extend(doc)
+            path = 'page' not in params and links[0]
+        return rv
 
-    def _post(self, path, **kwargs):
+    def _jpost(self, path, data, httpAuth=True):
+        return self._jcall(path, data, httpAuth)
+
+    def _send(self, event, path, data, method):
+        kwargs = self._timeout()
+        if method:
+            kwargs['method'] = method
+        resp = self.fetcher(self.BASE_URL + path, data, **kwargs)
+        _describe(event, resp)
+        body = _timed(event, 'read', resp.read)
+        if event is not None:
+            event['bytes'] = len(body)
+        return body
+
+    def _write(self, path, method, kwargs):
         p = {'login': self.user, 'token': self.token}
         p.update(kwargs)
-        return self.fetcher(self.BASE_URL + path, urlencode(p)).read()
+        data = urlencode(p)
+        if not self.sinks:
+            return self._send(None, path, data, method)
+        return self._instrumented(method or 'POST', self.BASE_URL + path,
+                                  self._send, path, data, method)
+
+    def _post(self, path, **kwargs):
+        return self._write(path, None, kwargs)
 
     def _put(self, path, **kwargs):
-        p = {'login': self.user, 'token': self.token}
-        p.update(kwargs)
-        # Setting PUT with urllib2: http://stackoverflow.com/questions/111945
-        import urllib2
-        opener = urllib2.build_opener(urllib2.HTTPHandler)
-        request = urllib2.Request(self.BASE_URL + path, data=hclient.urlencode(p))
-        request.get_method = lambda: 'PUT'
-        return opener.open(request).read()
+        return self._write(path, 'PUT', kwargs)
+
+    def _parseDoc(self, event, path):
+        types = self.types
+        if self.dates:
+            types = _withDates(types)
+        if not _streamable(types):
+            doc = self._fetch(path, event=event)
+            return _timed(event, 'build', _parse, doc.documentElement, types)
+
+        # Parsed documents are shared by _parsed, so the body can be
+        # parsed as it's read rather than buffered for sharing here.
+        resp = self._raw_fetch(path, event=event, coalesce=False)
+        pool = self.interning
+        if pool is True:
+            pool = InternPool()
+        elif pool is False:
+            pool = None
+        parser = _StreamParser(types, self.streaming, self.lazy, pool=pool)
+        chunks = _feed(resp, parser, event)
+        for n in chunks:
+            if parser.items is not None:
+                return _ItemStream(chunks, parser)
+        return _resolved(parser.root)
 
     def _parsed(self, path):
-        doc = self._fetch(path)
-        return _parse(doc.documentElement)
+        """Fetch and parse a document.
+
+        Concurrent identical calls share the parsed result.  When
+        streaming, arrays are returned as iterators instead, and
+        nothing is shared."""
+        if self.streaming:
+            if self.sinks:
+                return self._instrumented('GET', self.BASE_URL + path,
+                                          self._parseDoc, path)
+            return self._parseDoc(None, path)
+        if self.sinks:
+            parse = lambda: self._instrumented('GET', self.BASE_URL + path,
+                                               self._parseDoc, path)
+        else:
+            parse = lambda: self._parseDoc(None, path)
+        return self._coalesced(('parsed', self.BASE_URL + path,
+                                self.user, self.token, id(self.types)), parse)
+
+    def _fanout(self, fn, args, page, window):
+        """All the items of fn(*args + (page,)) and the pages after it,
+        fetching window pages concurrently."""
+        return list(_paginate(lambda n: fn(*(args + (n,))), page, window - 1))
 
     def _posted(self,path,**kwargs):
         stuff = self._post(path,**kwargs)
         doc = xml.dom.minidom.parseString(stuff)
-        return _parse(doc.documentElement)
+        return _parse(doc.documentElement, self.types)
 
 class UserEndpoint(BaseEndpoint):
 
+    @traced
     def search(self, query):
         """Search for a user."""
         return self._parsed('user/search/' + query)
 
+    @traced
     def show(self, username):
         """Get the info for a user."""
         return self._parsed('user/show/' + username)
 
+    @traced
     def keys(self):
         """Get the public keys for a user."""
         return self._parsed('user/keys')
 
+    @traced
     def removeKey(self, keyId):
         """Remove the key with the given ID (as retrieved from keys)"""
         self._post('user/key/remove', id=keyId)
 
+    @traced
     def addKey(self, name, key):
         """Add an ssh key."""
         self._post('user/key/add', name=name, key=key)
 
 class RepositoryEndpoint(BaseEndpoint):
 
-    def forUser(self, username, page=1):
-        """Get the repositories for the given user."""
+    @traced
+    def forUser(self, username, page=1, window=None):
+        """Get the repositories for the given user.
+
+        With a window, this page and all the ones after it are fetched,
+        window pages at a time."""
+        if window:
+            return self._fanout(self.forUser, (username,), page, window)
         return self._parsed('repos/show/' + username + "/?page=" + str(page))
 
+    @traced
+    def iterForUser(self, username, page=1, prefetch=1):
+        """Iterate the repositories for the given user across all pages.
+
+        prefetch pages beyond the current one are fetched in the
+        background."""
+        return _paginate(lambda n: self.forUser(username, n), page, prefetch)
+
+    @traced
     def branches(self, user, repo):
         """List the branches for a repo."""
         doc = self._fetch("repos/show/" + user + "/" + repo + "/branches")
@@ -370,6 +1482,7 @@ class RepositoryEndpoint(BaseEndpoint):
                 rv[c.localName] = str(c.firstChild.data)
         return rv
 
+    @traced
     def languages(self, user, repo):
         """List the languages for a repo."""
         doc = self._fetch("repos/show/" + user + "/" + repo + "/languages", True)
@@ -379,6 +1492,7 @@ class RepositoryEndpoint(BaseEndpoint):
                 rv[c.localName] = str(c.firstChild.data)
         return rv
 
+    @traced
     def tags(self, user, repo):
         """List the tags for a repo."""
         doc = self._fetch("repos/show/" + user + "/" + repo + "/tags")
@@ -388,6 +1502,7 @@ class RepositoryEndpoint(BaseEndpoint):
                 rv[c.localName] = str(c.firstChild.data)
         return rv
 
+    @traced
     def search(self, term, **args):
         """Search for repositories.
 
@@ -401,10 +1516,12 @@ class RepositoryEndpoint(BaseEndpoint):
             path += '?%s' % params
         return self._parsed(path)
 
+    @traced
     def show(self, user, repo):
         """Lookup an individual repository."""
         return self._parsed('/'.join(['repos', 'show', user, repo]))
 
+    @traced
     def set(self, user, repo, **args):
         """Set repository parameters.
 
@@ -422,22 +1539,27 @@ class RepositoryEndpoint(BaseEndpoint):
         return self._post('/'.join(['repos', 'show', user, repo]),
                           **prepared_args)
 
+    @traced
     def watch(self, user, repo):
         """Watch a repository."""
         self._post('repos/watch/' + user + '/' + repo)
 
+    @traced
     def unwatch(self, user, repo):
         """Stop watching a repository."""
         self._post('repos/unwatch/' + user + '/' + repo)
 
+    @traced
     def watched(self, user):
         """Get watched repositories of a user."""
         return self._parsed('repos/watched/' + user)
 
+    @traced
     def network(self, user, repo):
         """Get the network for a given repo."""
         return self._parsed('repos/show/' + user + '/' + repo + '/network')
 
+    @traced
     def setVisible(self, repo, public=True):
         """Set the visibility of the given repository (owned by the current user)."""
         if public:
@@ -446,68 +1568,164 @@ class RepositoryEndpoint(BaseEndpoint):
             path = 'repos/set/private/' + repo
         self._post(path)
 
+    @traced
     def create(self, name, description='', homepage='', public=1):
         """Create a new repository."""
         self._post('repos/create', name=name, description=description,
                    homepage=homepage, public=str(public))
 
+    @traced
     def delete(self, repo):
         """Delete a repository."""
         self._post('repos/delete/' + repo)
 
+    @traced
     def fork(self, user, repo):
         """Fork a user's repo."""
         self._post('repos/fork/' + user + '/' + repo)
 
+    @traced
     def watchers(self, user, repo):
         """Find all of the watchers of one of your repositories."""
         return self._parsed('repos/show/%s/%s/watchers' % (user, repo))
 
+    @traced
     def collaborators(self, user, repo):
         """Find all of the collaborators of one of your repositories."""
         return self._parsed('repos/show/%s/%s/collaborators' % (user, repo))
 
+    @traced
     def addCollaborator(self, repo, username):
         """Add a collaborator to one of your repositories."""
         self._post('repos/collaborators/' + repo + '/add/' + username)
 
+    @traced
     def removeCollaborator(self, repo, username):
         """Remove a collaborator from one of your repositories."""
         self._post('repos/collaborators/' + repo + '/remove/' + username)
 
-    def collaborators_all(self):
-        """Find all of the collaborators of every of your repositories.
+    def _forEach(self, names, fn, concurrency):
+        """A PartialResult of fn(name) for each name, calling up to
+        concurrency at once.
 
-        Returns a dictionary with reponame as key and a list of collaborators as value."""
-        ret = {}
-        for reponame in (rp.name for rp in self.forUser(self.user)):
-            ret[reponame] = self.collaborators(self.user, reponame)
-        return ret
+        Running past the deadline stops everything."""
+        rv = PartialResult()
+        def one(n):
+            try:
+                rv[n] = fn(n)
+            except DeadlineExceeded:
+                raise
+            except Exception, e:
+                rv.errors[n] = e
+        if concurrency <= 1:
+            for n in names:
+                one(n)
+            return rv
+        hclient.allowConnections(concurrency)
+        pool = workers.WorkerPool(concurrency)
+        futures = pool.map(one, names)
+        try:
+            for f in futures:
+                f.result()
+        finally:
+            for f in futures:
+                f.cancel()
+            pool.shutdown(wait=False)
+        return rv
 
-    def addCollaborator_all(self, username):
-        """Add a collaborator to all of your repositories."""
-        for reponame in (rp.name for rp in self.forUser(self.user)):
-            self.addCollaborator(reponame, username)
+    @traced
+    def collaborators_all(self, deadline=None, concurrency=1):
+        """Find all of the collaborators of every of your repositories.
 
-    def removeCollaborator_all(self, username):
-        """Remove a collaborator from all of your repositories."""
-        for reponame in (rp.name for rp in self.forUser(self.user)):
-            self.removeCollaborator(reponame, username)
+        Returns a dictionary with reponame as key and a list of collaborators as value.
+        Up to concurrency repositories are asked at once.  Repositories
+        whose collaborators couldn't be fetched are left out, with
+        their exceptions in the result's errors dictionary.
+        If deadline is given, all of the requests must finish within
+        that many seconds or DeadlineExceeded is raised."""
+        ep = self._withDeadline(deadline)
+        names = [rp.name for rp in ep.iterForUser(self.user, prefetch=0)]
+        # Streamed lists are read out here, freeing their connections.
+        return ep._forEach(names,
+                           lambda n: list(ep.collaborators(self.user, n)),
+                           concurrency)
+
+    def _reconcile(self, username, wanted, deadline, concurrency, budget):
+        """Add (or remove, if not wanted) username on every repository
+        where that would change anything."""
+        ep = self._withDeadline(deadline)
+        current = ep.collaborators_all(concurrency=concurrency)
+        rv = PartialResult()
+        rv.errors.update(current.errors)
+        todo = []
+        for reponame, collabs in current.iteritems():
+            present = username.lower() in [c.lower() for c in collabs]
+            if present == wanted:
+                rv[reponame] = 'unchanged'
+            else:
+                todo.append(reponame)
+
+        fn = wanted and ep.addCollaborator or ep.removeCollaborator
+        def change(reponame):
+            if budget is not None:
+                budget.acquire()
+            fn(reponame, username)
+            return wanted and 'added' or 'removed'
+        changed = ep._forEach(todo, change, concurrency)
+        rv.update(changed)
+        rv.errors.update(changed.errors)
+        return rv
 
+    @traced
+    def addCollaborator_all(self, username, deadline=None, reconcile=False,
+                            concurrency=1, budget=None):
+        """Add a collaborator to all of your repositories.
+
+        With reconcile, the current collaborators of every repository
+        are fetched first and only the repositories missing username
+        are changed, up to concurrency requests at once, each taking a
+        token from budget (e.g. a ratelimit.TokenBucket) if given.
+        That returns a PartialResult of 'added' or 'unchanged' by
+        repository name, with the failures in its errors."""
+        if reconcile:
+            return self._reconcile(username, True, deadline, concurrency,
+                                   budget)
+        ep = self._withDeadline(deadline)
+        for reponame in (rp.name for rp in ep.forUser(self.user)):
+            ep.addCollaborator(reponame, username)
+
+    @traced
+    def removeCollaborator_all(self, username, deadline=None, reconcile=False,
+                               concurrency=1, budget=None):
+        """Remove a collaborator from all of your repositories.
+
+        reconcile, concurrency and budget are as for addCollaborator_all,
+        the result holding 'removed' or 'unchanged' by repository name."""
+        if reconcile:
+            return self._reconcile(username, False, deadline, concurrency,
+                                   budget)
+        ep = self._withDeadline(deadline)
+        for reponame in (rp.name for rp in ep.forUser(self.user)):
+            ep.removeCollaborator(reponame, username)
+
+    @traced
     def deployKeys(self, repo):
         """List the deploy keys for the given repository.
 
         The repository must be owned by the current user."""
         return self._parsed('repos/keys/' + repo)
 
+    @traced
     def addDeployKey(self, repo, title, key):
         """Add a deploy key to a repository."""
         self._post('repos/key/' + repo + '/add', title=title, key=key)
 
+    @traced
     def removeDeployKey(self, repo, keyId):
         """Remove a deploy key."""
         self._post('repos/key/' + repo + '/remove', id=keyId)
 
+    @traced
     def discoverHooks(self):
         """Get the known hook types supported by github.
 
@@ -516,16 +1734,19 @@ class RepositoryEndpoint(BaseEndpoint):
         hooks = self._jfetch('hooks', httpAuth=False)
         return dict((h['name'], h) for h in hooks)
 
+    @traced
     def listHooks(self, user, repo):
         """List hooks configured for a repo."""
         # /repos/:user/:repo/hooks
         return self._jfetch('/'.join(['repos', user, repo, 'hooks']))
 
+    @traced
     def getHook(self, user, repo, hookid):
         """Get a specific hook by ID."""
         return self._jfetch('/'.join(['repos', user, repo, 'hooks',
                                       str(hookid)]))
 
+    @traced
     def createHook(self, user, repo, name, config,
                    events=["push"], active=True):
         """Create a hook on the given repo.
@@ -541,6 +1762,7 @@ class RepositoryEndpoint(BaseEndpoint):
 
         return self._jpost('/'.join(['repos', user, repo, 'hooks']), doc)
 
+    @traced
     def testHook(self, user, repo, hookid):
         """Test a specific hook by ID."""
         return self._raw_fetch('/'.join(['repos', user, repo, 'hooks',
@@ -548,6 +1770,7 @@ class RepositoryEndpoint(BaseEndpoint):
                                base='https://api.github.com/',
                                data='', httpAuth=True).read()
 
+    @traced
     def deleteHook(self, user, repo, hookid):
         """Remove a specified hook."""
         return self._raw_fetch('/'.join(['repos', user, repo, 'hooks',
@@ -558,46 +1781,81 @@ class RepositoryEndpoint(BaseEndpoint):
 
 class CommitEndpoint(BaseEndpoint):
 
-    def forBranch(self, user, repo, branch='master', page=1):
-        """Get the commits for the given branch."""
+    @traced
+    def forBranch(self, user, repo, branch='master', page=1, window=None):
+        """Get the commits for the given branch.
+
+        With a window, this page and all the ones after it are fetched,
+        window pages at a time."""
+        if window:
+            return self._fanout(self.forBranch, (user, repo, branch), page,
+                                window)
         return self._parsed('/'.join(['commits', 'list', user, repo, branch])+ "?page=" + str(page))
 
+    @traced
+    def iterForBranch(self, user, repo, branch='master', page=1, prefetch=1):
+        """Iterate the commits for the given branch across all pages.
+
+        prefetch pages beyond the current one are fetched in the
+        background."""
+        return _paginate(lambda n: self.forBranch(user, repo, branch, n),
+                         page, prefetch)
+
+    @traced
+    def forBranchSince(self, user, repo, branch='master', since=None,
+                       prefetch=0):
+        """Get the commits on the given branch newer than the since sha.
+
+        Pages are only fetched until since is found.  If it's None, or
+        no longer on the branch, the whole history comes back."""
+        rv = []
+        commits = self.iterForBranch(user, repo, branch, prefetch=prefetch)
+        try:
+            for c in commits:
+                if c.id == since:
+                    break
+                rv.append(c)
+        finally:
+            commits.close()
+        return rv
+
+    @traced
     def forFile(self, user, repo, path, branch='master'):
         """Get the commits for the given file within the given branch."""
         return self._parsed('/'.join(['commits', 'list', user, repo, branch, path]))
 
-    @with_temporary_mappings({'removed': _parseArray,
-                              'added': _parseArray,
+    # Each <removed>/<added> entry wraps a single <filename>.
+    @with_temporary_mappings({'removed': _parseFirst,
+                              'added': _parseFirst,
                               'modified': Modification,
                               'diff': _string_parser,
                               'filename': _string_parser})
+    @traced
     def show(self, user, repo, sha):
         """Get an individual commit."""
-        c = self._parsed('/'.join(['commits', 'show', user, repo, sha]))
-        # Some fixup due to weird XML structure
-        if hasattr(c, 'removed'):
-            c.removed = [i[0] for i in c.removed]
-        if hasattr(c, 'added'):
-            c.added = [i[0] for i in c.added]
-        return c
+        return self._parsed('/'.join(['commits', 'show', user, repo, sha]))
 
 class IssuesEndpoint(BaseEndpoint):
 
     @with_temporary_mappings({'user': None})
+    @traced
     def search(self, user, repo, state, search_term):
         """Search the issues for the given repo for the given state and search term."""
         return self._parsed('/'.join(['issues', 'search', user, repo, state,
                                       hclient.quote_plus(search_term)]))
 
     @with_temporary_mappings({'user': None})
+    @traced
     def list(self, user, repo, state='open'):
         """Get the list of issues for the given repo in the given state."""
         return self._parsed('/'.join(['issues', 'list', user, repo, state]))
 
     @with_temporary_mappings({'user': None})
+    @traced
     def comments(self, user, repo, issue_id):
         return self._parsed('/'.join(['issues', 'comments', user, repo, str(issue_id)]))
 
+    @traced
     def add_comment(self, user, repo, issue_id, comment):
         """Add a comment to an issue."""
         return self._post('/'.join(['issues', 'comment', user,
@@ -605,33 +1863,40 @@ class IssuesEndpoint(BaseEndpoint):
                           comment=comment)
 
     @with_temporary_mappings({'user': None})
+    @traced
     def show(self, user, repo, issue_id):
         """Show an individual issue."""
         return self._parsed('/'.join(['issues', 'show', user, repo, str(issue_id)]))
 
+    @traced
     def add_label(self, user, repo, issue_id, label):
         """Add a label to an issue."""
         self._post('issues/label/add/' + user + '/'
                        + repo + '/' + label + '/' + str(issue_id))
 
+    @traced
     def remove_label(self, user, repo, issue_id, label):
         """Remove a label from an issue."""
         self._post('issues/label/remove/' + user + '/'
                    + repo + '/' + label + '/' + str(issue_id))
 
+    @traced
     def close(self, user, repo, issue_id):
         """Close an issue."""
         self._post('/'.join(['issues', 'close', user, repo, str(issue_id)]))
 
+    @traced
     def reopen(self, user, repo, issue_id):
         """Reopen an issue."""
         self._post('/'.join(['issues', 'reopen', user, repo, str(issue_id)]))
 
+    @traced
     def new(self, user, repo, title, body=''):
         """Create a new issue."""
         return self._posted('/'.join(['issues', 'open', user, repo]),
                             title=title, body=body)
 
+    @traced
     def edit(self, user, repo, issue_id, title, body):
         """Create a new issue."""
         self._post('/'.join(['issues', 'edit', user, repo, str(issue_id)]),
@@ -640,15 +1905,18 @@ class IssuesEndpoint(BaseEndpoint):
 class ObjectsEndpoint(BaseEndpoint):
 
     @with_temporary_mappings({'tree': Tree, 'type': _string_parser})
+    @traced
     def tree(self, user, repo, t):
         """Get the given tree from the given repo."""
         tl = self._parsed('/'.join(['tree', 'show', user, repo, t]))
         return dict([(t.name, t) for t in tl])
 
     @with_temporary_mappings({'blob': Blob})
+    @traced
     def blob(self, user, repo, t, fn):
         return self._parsed('/'.join(['blob', 'show', user, repo, t, fn]))
 
+    @traced
     def raw_blob(self, user, repo, sha):
         """Get a raw blob from a repo."""
         path = 'blob/show/%s/%s/%s' % (user, repo, sha)
@@ -656,18 +1924,22 @@ class ObjectsEndpoint(BaseEndpoint):
 
 class OrganizationsEndpoint(BaseEndpoint):
 
+    @traced
     def show(self, org):
         """Get the info of an organization."""
         return self._parsed('organizations/' + org)
 
+    @traced
     def forUser(self, username):
         """Get the organizations for the given user."""
         return self._parsed('user/show/' + username + "/organizations")
 
+    @traced
     def forMe(self):
         """Get the organizations for an authenticated user."""
         return self._parsed('organizations')
 
+    @traced
     def set(self, org, **args):
         """Set organization parameters.
 
@@ -684,18 +1956,22 @@ class OrganizationsEndpoint(BaseEndpoint):
         return self._put('/'.join(['organizations', org]),
             **prepared_args)
 
+    @traced
     def repositories(self):
         """List repositories across all the organizations that an authenticated user can access."""
         return self._parsed("organizations/repositories")
 
+    @traced
     def owners(self, org):
         """List the owners of an organization."""
         return self._parsed("organizations/" + org + "/owners")
 
+    @traced
     def publicRepositories(self, org):
         """List the public repositories for an organization."""
         return self._parsed("organizations/" + org + "/public_repositories")
 
+    @traced
     def publicMembers(self, org):
         """List the public members of an organization."""
         return self._parsed("organizations/" + org + "/public_members")
@@ -703,49 +1979,594 @@ class OrganizationsEndpoint(BaseEndpoint):
 
 class TeamsEndpoint(BaseEndpoint):
 
+    @traced
     def addUserToTeam(self, team_id, username):
         self._post('teams/%s/members' % str(team_id), name=username)
 
+    @traced
     def addRepoToTeam(self, team_id, user, repo):
         self._post('teams/%s/repositories' % team_id, name="%s/%s" % (user, repo))
 
+# v3 (JSON) implementations of the read calls.  They build the same
+# models as the v2 calls, renaming v3 fields to their v2 names.  Calls
+# without a v3 version here still go through v2.
+
+def _login(user):
+    return user['login']
+
+def _fromV3(cls, d, fields={}):
+    """Build a model from a v3 JSON object.
+
+    fields maps v3 field names to (v2 name, conversion or None); other
+    fields are kept as they are."""
+    rv = cls.__new__(cls)
+    for k, v in d.iteritems():
+        f = fields.get(k)
+        if f is not None:
+            k, conv = f
+            if conv is not None and v is not None:
+                v = conv(v)
+        setattr(rv, k, v)
+    return rv
+
+_V3_USER = {'public_repos': ('public_repo_count', None),
+            'public_gists': ('public_gist_count', None),
+            'followers': ('followers_count', None),
+            'following': ('following_count', None)}
+
+_V3_REPOSITORY = {'owner': ('owner', _login),
+                  'organization': ('organization', _login),
+                  'html_url': ('url', None),
+                  'url': ('api_url', None),
+                  'watchers_count': ('watchers', None),
+                  'forks_count': ('forks', None),
+                  'open_issues_count': ('open_issues', None),
+                  'default_branch': ('master_branch', None)}
+
+_V3_ISSUE = {'user': ('user', _login),
+             'labels': ('labels',
+                        lambda ls: [_fromV3(Label, l) for l in ls])}
+
+_V3_TREE = {'path': ('name', None)}
+
+_V3_BLOB = {'content': ('data', base64.b64decode)}
+
+def _personFromV3(cls, d, role):
+    person = d['commit'][role] or {}
+    rv = cls._fromPairs([('name', person.get('name')),
+                         ('email', person.get('email'))])
+    if d.get(role):
+        rv.login = d[role]['login']
+    return rv, person.get('date')
+
+def _commitFromV3(d):
+    """Build a v2 style Commit from a v3 commit."""
+    rv = Commit._fromPairs([('id', d['sha']),
+                            ('url', d.get('html_url')),
+                            ('message', d['commit']['message']),
+                            ('tree', d['commit']['tree']['sha'])])
+    rv.author, rv.authored_date = _personFromV3(Author, d, 'author')
+    rv.committer, rv.committed_date = _personFromV3(Committer, d, 'committer')
+    rv.parents = [Parent._fromPairs([('id', p['sha'])])
+                  for p in d.get('parents', [])]
+    if 'files' in d:
+        files = d['files']
+        rv.added = [f['filename'] for f in files if f['status'] == 'added']
+        rv.removed = [f['filename'] for f in files if f['status'] == 'removed']
+        rv.modified = [Modification._fromPairs([('filename', f['filename']),
+                                                ('diff', f.get('patch'))])
+                       for f in files
+                       if f['status'] not in ('added', 'removed')]
+    return rv
+
+def _namedShas(doc):
+    return dict((str(d['name']), str(d['commit']['sha'])) for d in doc)
+
+class V3UserEndpoint(UserEndpoint):
+
+    @traced
+    def search(self, query):
+        """Search for a user."""
+        doc = self._v3list('search/users', q=query)
+        return [_fromV3(User, d, _V3_USER) for d in doc]
+
+    @traced
+    def show(self, username):
+        """Get the info for a user."""
+        return _fromV3(User, self._v3get('users/' + username), _V3_USER)
+
+    @traced
+    def keys(self):
+        """Get the public keys for a user."""
+        return [_fromV3(PublicKey, d) for d in self._v3list('user/keys')]
+
+class V3RepositoryEndpoint(RepositoryEndpoint):
+
+    def _repos(self, path, **params):
+        return [_fromV3(Repository, d, _V3_REPOSITORY)
+                for d in self._v3list(path, **params)]
+
+    @traced
+    def forUser(self, username, page=1, window=None):
+        """Get the repositories for the given user.
+
+        Your own private repositories are included when you're logged
+        in."""
+        if window:
+            return self._fanout(self.forUser, (username,), page, window)
+        if self.token and username == self.user:
+            return self._repos('user/repos', page=page)
+        return self._repos('users/%s/repos' % username, page=page)
+
+    @traced
+    def branches(self, user, repo):
+        """List the branches for a repo."""
+        return _namedShas(self._v3list('repos/%s/%s/branches' % (user, repo)))
+
+    @traced
+    def languages(self, user, repo):
+        """List the languages for a repo."""
+        doc = self._v3get('repos/%s/%s/languages' % (user, repo))
+        return dict((str(k), str(v)) for k, v in doc.items())
+
+    @traced
+    def tags(self, user, repo):
+        """List the tags for a repo."""
+        return _namedShas(self._v3list('repos/%s/%s/tags' % (user, repo)))
+
+    @traced
+    def search(self, term, **args):
+        """Search for repositories.
+
+        Accept arguments to filter the search:
+        - start_page => specifies the page of the results to show
+        - language   => limits the search to a programming language """
+        if 'language' in args:
+            term += ' language:' + args['language']
+        doc = self._v3list('search/repositories', q=term,
+                           page=args.get('start_page', 1))
+        return [_fromV3(Repository, d, _V3_REPOSITORY) for d in doc]
+
+    @traced
+    def show(self, user, repo):
+        """Get the info for a repo."""
+        return _fromV3(Repository, self._v3get('repos/%s/%s' % (user, repo)),
+                       _V3_REPOSITORY)
+
+    @traced
+    def watched(self, user):
+        """Get the list of repos watched by the given user."""
+        return self._repos('users/%s/starred' % user)
+
+    @traced
+    def network(self, user, repo):
+        """Get the forks of a repo."""
+        return [_fromV3(Network, d, _V3_REPOSITORY)
+                for d in self._v3list('repos/%s/%s/forks' % (user, repo))]
+
+    @traced
+    def watchers(self, user, repo):
+        """Find all of the watchers of one of your repositories."""
+        doc = self._v3list('repos/%s/%s/stargazers' % (user, repo))
+        return [_login(d) for d in doc]
+
+    @traced
+    def collaborators(self, user, repo):
+        """Find all of the collaborators of one of your repositories."""
+        doc = self._v3list('repos/%s/%s/collaborators' % (user, repo))
+        return [_login(d) for d in doc]
+
+    @traced
+    def deployKeys(self, repo):
+        """List the deploy keys for the given repository.
+
+        The repository must be owned by the current user."""
+        doc = self._v3list('repos/%s/%s/keys' % (self.user, repo))
+        return [_fromV3(PublicKey, d) for d in doc]
+
+class V3CommitEndpoint(CommitEndpoint):
+
+    @traced
+    def forBranch(self, user, repo, branch='master', page=1, window=None):
+        """Get the commits for the given branch."""
+        if window:
+            return self._fanout(self.forBranch, (user, repo, branch), page,
+                                window)
+        doc = self._v3list('repos/%s/%s/commits' % (user, repo),
+                           sha=branch, page=page)
+        return [_commitFromV3(d) for d in doc]
+
+    @traced
+    def forFile(self, user, repo, path, branch='master'):
+        """Get the commits for the given file within the given branch."""
+        doc = self._v3list('repos/%s/%s/commits' % (user, repo),
+                           sha=branch, path=path)
+        return [_commitFromV3(d) for d in doc]
+
+    @traced
+    def show(self, user, repo, sha):
+        """Get an individual commit."""
+        return _commitFromV3(self._v3get('repos/%s/%s/commits/%s'
+                                         % (user, repo, sha)))
+
+class V3IssuesEndpoint(IssuesEndpoint):
+
+    @traced
+    def search(self, user, repo, state, search_term):
+        """Search the issues for the given repo for the given state and search term."""
+        q = '%s repo:%s/%s state:%s is:issue' % (search_term, user, repo,
+                                                 state)
+        doc = self._v3list('search/issues', q=q)
+        return [_fromV3(Issue, d, _V3_ISSUE) for d in doc]
+
+    @traced
+    def list(self, user, repo, state='open'):
+        """Get the list of issues for the given repo in the given state."""
+        doc = self._v3list('repos/%s/%s/issues' % (user, repo), state=state)
+        return [_fromV3(Issue, d, _V3_ISSUE) for d in doc]
+
+    @traced
+    def comments(self, user, repo, issue_id):
+        doc = self._v3list('repos/%s/%s/issues/%s/comments'
+                           % (user, repo, issue_id))
+        return [_fromV3(IssueComment, d, _V3_ISSUE) for d in doc]
+
+    @traced
+    def show(self, user, repo, issue_id):
+        """Show an individual issue."""
+        doc = self._v3get('repos/%s/%s/issues/%s' % (user, repo, issue_id))
+        return _fromV3(Issue, doc, _V3_ISSUE)
+
+class V3ObjectsEndpoint(ObjectsEndpoint):
+
+    @traced
+    def tree(self, user, repo, t):
+        """Get the given tree from the given repo."""
+        doc = self._v3get('repos/%s/%s/git/trees/%s' % (user, repo, t))
+        tl = [_fromV3(Tree, d, _V3_TREE) for d in doc['tree']]
+        return dict([(t.name, t) for t in tl])
+
+    @traced
+    def blob(self, user, repo, t, fn):
+        doc = self._v3get('repos/%s/%s/contents/%s' % (user, repo, fn),
+                          ref=t)
+        return _fromV3(Blob, doc, _V3_BLOB)
+
+    @traced
+    def raw_blob(self, user, repo, sha):
+        """Get a raw blob from a repo."""
+        doc = self._v3get('repos/%s/%s/git/blobs/%s' % (user, repo, sha))
+        return base64.b64decode(doc['content'])
+
+class V3OrganizationsEndpoint(OrganizationsEndpoint):
+
+    def _orgs(self, path):
+        return [_fromV3(Organization, d, _V3_USER)
+                for d in self._v3list(path)]
+
+    def _users(self, path, **params):
+        return [_fromV3(User, d, _V3_USER)
+                for d in self._v3list(path, **params)]
+
+    @traced
+    def show(self, org):
+        """Get the info of an organization."""
+        return _fromV3(Organization, self._v3get('orgs/' + org), _V3_USER)
+
+    @traced
+    def forUser(self, username):
+        """Get the organizations for the given user."""
+        return self._orgs('users/%s/orgs' % username)
+
+    @traced
+    def forMe(self):
+        """Get the organizations for an authenticated user."""
+        return self._orgs('user/orgs')
+
+    @traced
+    def owners(self, org):
+        """List the owners of an organization."""
+        return self._users('orgs/%s/members' % org, role='admin')
+
+    @traced
+    def publicRepositories(self, org):
+        """List the public repositories for an organization."""
+        return [_fromV3(Repository, d, _V3_REPOSITORY)
+                for d in self._v3list('orgs/%s/repos' % org, type='public')]
+
+    @traced
+    def publicMembers(self, org):
+        """List the public members of an organization."""
+        return self._users('orgs/%s/public_members' % org)
+
+_V3_ENDPOINTS = {
+    UserEndpoint: V3UserEndpoint,
+    RepositoryEndpoint: V3RepositoryEndpoint,
+    CommitEndpoint: V3CommitEndpoint,
+    IssuesEndpoint: V3IssuesEndpoint,
+    ObjectsEndpoint: V3ObjectsEndpoint,
+    OrganizationsEndpoint: V3OrganizationsEndpoint,
+}
+
 class GitHub(object):
     """Interface to github."""
 
-    def __init__(self, user=None, token=None, fetcher=hclient.fetch, base_url=None):
+    def __init__(self, user=None, token=None, fetcher=hclient.fetch, base_url=None,
+                 coalesce=True, streaming=False, api='v2', lazy=False,
+                 interning=None, dates=False):
+        if api not in ('v2', 'v3'):
+            raise ValueError("Unknown API version: %r" % api)
         self.user    = user
         self.token   = token
         self.fetcher = fetcher
+        # Which API read calls use: 'v2' (XML) or 'v3' (JSON).
+        self.api     = api
+        # Extra attributes for every endpoint handed out.
+        self.options = {}
 
         if base_url:
             BaseEndpoint.BASE_URL = base_url
+        if coalesce:
+            self.options['flights'] = workers.SingleFlight()
+        self.options['sinks'] = []
+        self.options['streaming'] = streaming
+        self.options['lazy'] = lazy
+        self.options['interning'] = interning
+        self.options['dates'] = dates
+        # The batch (if any) each thread is collecting calls into.
+        self._batches = threading.local()
+
+    def subscribe(self, sink):
+        """Call sink(event) after every request.
+
+        The event is a dict with the endpoint method called (endpoint),
+        the URL with the method's arguments replaced by :name
+        (template), url, method, status, bytes, cache ('hit', 'miss' or
+        None) and timings, a dict of seconds spent in each phase: queue,
+        connect and first_byte (see hclient.PooledResponse), read, parse
+        (XML/JSON decoding; for streamed XML this includes creating
+        objects), build (creating objects from a DOM) and total."""
+        self.options['sinks'].append(sink)
+
+    def unsubscribe(self, sink):
+        """Stop sending events to the given sink."""
+        self.options['sinks'].remove(sink)
+
+    def _endpoint(self, cls):
+        if self.api == 'v3':
+            cls = _V3_ENDPOINTS.get(cls, cls)
+        ep = cls(self.user, self.token, self.fetcher, **self.options)
+        batch = getattr(self._batches, 'current', None)
+        if batch is not None:
+            return _BatchEndpoint(ep, batch)
+        return ep
+
+    @contextlib.contextmanager
+    def batch(self, concurrency=10):
+        """Collect calls made in this thread and run them together.
+
+        Within the with block, endpoint calls return a workers.Future
+        instead of blocking; don't wait on them there.  When the block
+        ends the calls run, up to concurrency at once, identical reads
+        sharing one execution, and the block only exits once they've
+        all finished.  If the block raises, the calls are cancelled."""
+        if getattr(self._batches, 'current', None) is not None:
+            # Calls in a nested batch join the outer one.
+            yield
+            return
+        b = self._batches.current = _Batch()
+        finished = False
+        try:
+            yield
+            finished = True
+        finally:
+            self._batches.current = None
+            if not finished:
+                b.cancel()
+        b.run(concurrency)
 
     @property
     def users(self):
         """Get access to the user API."""
-        return UserEndpoint(self.user, self.token, self.fetcher)
+        return self._endpoint(UserEndpoint)
 
     @property
     def repos(self):
         """Get access to the user API."""
-        return RepositoryEndpoint(self.user, self.token, self.fetcher)
+        return self._endpoint(RepositoryEndpoint)
+
+    @property
+    def commits(self):
+        return self._endpoint(CommitEndpoint)
+
+    @property
+    def issues(self):
+        return self._endpoint(IssuesEndpoint)
+
+    @property
+    def objects(self):
+        return self._endpoint(ObjectsEndpoint)
+
+    @property
+    def organizations(self):
+        return self._endpoint(OrganizationsEndpoint)
+
+    @property
+    def teams(self):
+        return self._endpoint(TeamsEndpoint)
+
+# Endpoint methods that only read, so a batch can share one call among
+# identical ones.  Anything else (and the iterators, which can't be
+# shared) runs once for every time it's called.
+_READS = frozenset(['blob', 'branches', 'collaborators', 'collaborators_all',
+                    'comments', 'deployKeys', 'discoverHooks', 'forBranch',
+                    'forBranchSince', 'forFile', 'forMe', 'forUser',
+                    'getHook', 'keys', 'languages', 'list', 'listHooks',
+                    'network', 'owners', 'publicMembers',
+                    'publicRepositories', 'raw_blob', 'repositories',
+                    'search', 'show', 'tags', 'tree', 'watched',
+                    'watchers'])
+
+class _Batch(object):
+    """Calls collected by GitHub.batch()."""
+
+    def __init__(self):
+        self._calls = []
+        self._futures = {}
+
+    def add(self, endpoint, name, fn, args, kwargs):
+        """A Future for fn(*args, **kwargs), shared by identical reads."""
+        key, f = None, None
+        if name in _READS:
+            key = (endpoint.__class__, endpoint.deadline, name, args,
+                   tuple(sorted(kwargs.items())))
+            try:
+                f = self._futures.get(key)
+            except TypeError:
+                # Unhashable arguments; run the call on its own.
+                key = None
+        if f is None:
+            f = workers.Future()
+            self._calls.append((f, fn, args, kwargs))
+            if key is not None:
+                self._futures[key] = f
+        return f
+
+    def _call(self, f, fn, args, kwargs):
+        if not f.start():
+            return
+        try:
+            f.set_result(fn(*args, **kwargs))
+        except Exception:
+            f.set_exception()
+
+    def run(self, concurrency):
+        """Run the calls, returning once they're all done."""
+        hclient.allowConnections(concurrency)
+        pool = workers.WorkerPool(concurrency)
+        try:
+            for call in self._calls:
+                pool.submit(self._call, *call)
+        finally:
+            pool.shutdown()
+
+    def cancel(self):
+        for f, fn, args, kwargs in self._calls:
+            f.cancel()
+
+class _BatchEndpoint(object):
+    """An endpoint whose calls are added to a batch."""
+
+    def __init__(self, endpoint, batch):
+        self._endpoint = endpoint
+        self._batch = batch
+
+    def __getattr__(self, name):
+        a = getattr(self._endpoint, name)
+        if not callable(a) or name.startswith('_'):
+            return a
+        def add(*args, **kwargs):
+            return self._batch.add(self._endpoint, name, a, args, kwargs)
+        add.__name__ = name
+        add.__doc__ = a.__doc__
+        return add
+
+class AsyncEndpoint(object):
+    """Wraps an endpoint so that its calls run on a worker pool.
+
+    Every method returns a workers.Future instead of its result."""
+
+    def __init__(self, endpoint, pool):
+        self._endpoint = endpoint
+        self._pool = pool
+
+    def __getattr__(self, name):
+        a = getattr(self._endpoint, name)
+        if not callable(a):
+            return a
+        def submit(*args, **kwargs):
+            return self._pool.submit(a, *args, **kwargs)
+        submit.__name__ = name
+        submit.__doc__ = a.__doc__
+        return submit
+
+class AsyncRepositoryEndpoint(AsyncEndpoint):
+    """Asynchronous repository access with concurrent fan-out."""
+
+    def _forAll(self, fn, *args):
+        """Call fn(reponame, *args) concurrently for each of your repos."""
+        def fanout(repos):
+            names = [rp.name for rp in repos]
+            return workers.chain(
+                workers.gather([fn(n, *args) for n in names]),
+                lambda results: dict(zip(names, results)))
+        return workers.chain(self.forUser(self.user), fanout)
+
+    def _withDeadline(self, seconds):
+        return self.__class__(self._endpoint._withDeadline(seconds),
+                              self._pool)
+
+    def collaborators_all(self, deadline=None):
+        """Find all of the collaborators of every of your repositories.
+
+        The result is a dictionary with reponame as key and a list of
+        collaborators as value."""
+        ep = self._withDeadline(deadline)
+        def collaborators(n):
+            # Streamed lists are read out, freeing their connections.
+            return workers.chain(ep.collaborators(self.user, n), list)
+        return ep._forAll(collaborators)
+
+    def addCollaborator_all(self, username, deadline=None):
+        """Add a collaborator to all of your repositories."""
+        ep = self._withDeadline(deadline)
+        return workers.chain(ep._forAll(ep.addCollaborator, username),
+                             lambda r: None)
+
+    def removeCollaborator_all(self, username, deadline=None):
+        """Remove a collaborator from all of your repositories."""
+        ep = self._withDeadline(deadline)
+        return workers.chain(ep._forAll(ep.removeCollaborator, username),
+                             lambda r: None)
+
+class AsyncGitHub(GitHub):
+    """Interface to github where every call returns a workers.Future.
+
+    At most concurrency requests are in flight at once."""
+
+    def __init__(self, user=None, token=None, fetcher=hclient.fetch,
+                 base_url=None, concurrency=10, **options):
+        GitHub.__init__(self, user, token, fetcher, base_url, **options)
+        hclient.allowConnections(concurrency)
+        self.pool = workers.WorkerPool(concurrency)
+
+    def _async(self, endpoint, cls=AsyncEndpoint):
+        return cls(endpoint, self.pool)
+
+    @property
+    def users(self):
+        return self._async(GitHub.users.fget(self))
+
+    @property
+    def repos(self):
+        return self._async(GitHub.repos.fget(self), AsyncRepositoryEndpoint)
 
     @property
     def commits(self):
-        return CommitEndpoint(self.user, self.token, self.fetcher)
+        return self._async(GitHub.commits.fget(self))
 
     @property
     def issues(self):
-        return IssuesEndpoint(self.user, self.token, self.fetcher)
+        return self._async(GitHub.issues.fget(self))
 
     @property
     def objects(self):
-        return ObjectsEndpoint(self.user, self.token, self.fetcher)
+        return self._async(GitHub.objects.fget(self))
 
     @property
     def organizations(self):
-        return OrganizationsEndpoint(self.user, self.token, self.fetcher)
+        return self._async(GitHub.organizations.fget(self))
 
     @property
     def teams(self):
-        return TeamsEndpoint(self.user, self.token, self.fetcher)
+        return self._async(GitHub.teams.fget(self))
@@ -25,13 +25,43 @@
 Defines and runs unittests.
 """
 
+import os
+import copy
+import time
+import pickle
+import zlib
+import socket
+import gzip
+import tempfile
 import urllib
 import hashlib
 import unittest
+import threading
+import xml.dom.minidom
+import SocketServer
+import BaseHTTPServer
 
 import StringIO
 
+import dates
+import columns
+import cursors
 import github
+import hclient
+import ratelimit
+import cassette
+import workers
+
+def repoPages(url, pages=1):
+    """repos.xml for the first pages pages of a repo list (renamed after
+    the first), and an empty list after them."""
+    page = int(url.split('page=')[1].split('&')[0])
+    if page > pages:
+        return StringIO.StringIO('<repositories type="array"/>')
+    body = open('data/repos.xml').read()
+    if page > 1:
+        body = body.replace('</name>', '-%d</name>' % page)
+    return StringIO.StringIO(body)
 
 class BaseCase(unittest.TestCase):
 
@@ -310,6 +340,99 @@ class RepoTest(BaseCase):
         self._ghp('repos/key/blah/remove', 'dustin', 'p',
                   id=5).repos.removeDeployKey('blah', 5)
 
+    def testCollaboratorsAll(self):
+        """Collaborators are fetched concurrently, failures reported."""
+        lock = threading.Lock()
+        running = [0, 0]
+        def opener(url, data=None):
+            if '/collaborators' not in url:
+                return repoPages(url)
+            repo = url.split('/')[-2]
+            lock.acquire()
+            running[0] += 1
+            running[1] = max(running)
+            lock.release()
+            time.sleep(0.02)
+            lock.acquire()
+            running[0] -= 1
+            lock.release()
+            if repo == 'wokkel':
+                raise hclient.HTTPError(url, 403, 'Forbidden', {}, None)
+            return StringIO.StringIO(AsyncTest.COLLABS % repo)
+        gh = github.GitHub('verbal', None, fetcher=opener)
+        rv = gh.repos.collaborators_all(concurrency=4)
+        self.assertTrue(isinstance(rv, dict))
+        self.assertEquals(9, len(rv))
+        self.assertEquals(['wokkel'], rv.errors.keys())
+        self.assertEquals(403, rv.errors['wokkel'].code)
+        self.assertEquals(['dustin', 'hollaback'],
+                          rv['hollaback'])
+        self.assertEquals(4, running[1])
+
+    def testCollaboratorsAllPages(self):
+        """Every page of repositories is asked about."""
+        def opener(url, data=None):
+            if '/collaborators' not in url:
+                return repoPages(url, 2)
+            return StringIO.StringIO(AsyncTest.COLLABS % url.split('/')[-2])
+        gh = github.GitHub('verbal', None, fetcher=opener)
+        rv = gh.repos.collaborators_all(concurrency=4)
+        self.assertEquals(20, len(rv))
+        self.assertEquals(['dustin', 'wokkel-2'], rv['wokkel-2'])
+
+    def _reconciling(self, posts, pages=1):
+        def opener(url, data=None):
+            if data is not None:
+                posts.append(url.split('/api/v2/xml/')[1])
+                if '/wokkel/' in url:
+                    raise hclient.HTTPError(url, 500, 'Oops', {}, None)
+                return StringIO.StringIO('')
+            if '/collaborators' not in url:
+                return repoPages(url, pages)
+            return StringIO.StringIO(AsyncTest.COLLABS % url.split('/')[-2])
+        return github.GitHub('verbal', 'p', fetcher=opener)
+
+    def testAddCollaboratorReconciled(self):
+        """Only repos missing the collaborator are changed."""
+        class Budget(object):
+            taken = 0
+            def acquire(self):
+                self.taken += 1
+        posts = []
+        budget = Budget()
+        gh = self._reconciling(posts)
+        rv = gh.repos.addCollaborator_all('Hollaback', reconcile=True,
+                                          concurrency=4, budget=budget)
+        self.assertEquals(9, len(posts))
+        self.assertEquals(9, budget.taken)
+        self.assertFalse('repos/collaborators/hollaback/add/Hollaback'
+                         in posts)
+        self.assertEquals('unchanged', rv['hollaback'])
+        self.assertEquals('added', rv['twitter_bots'])
+        self.assertEquals(['wokkel'], rv.errors.keys())
+        self.assertEquals(9, len(rv))
+
+    def testReconciledPages(self):
+        """Repositories past the first page are reconciled too."""
+        posts = []
+        gh = self._reconciling(posts, 2)
+        rv = gh.repos.addCollaborator_all('hollaback', reconcile=True)
+        self.assertEquals(19, len(posts))
+        self.assertEquals('unchanged', rv['hollaback'])
+        self.assertEquals('added', rv['hollaback-2'])
+        self.assertEquals('added', rv['wokkel-2'])
+        self.assertEquals(['wokkel'], rv.errors.keys())
+
+    def testRemoveCollaboratorReconciled(self):
+        posts = []
+        gh = self._reconciling(posts)
+        rv = gh.repos.removeCollaborator_all('hollaback', reconcile=True)
+        self.assertEquals(['repos/collaborators/hollaback/remove/hollaback'],
+                          posts)
+        self.assertEquals('removed', rv['hollaback'])
+        self.assertEquals('unchanged', rv['wokkel'])
+        self.assertEquals({}, rv.errors)
+
 class CommitTest(BaseCase):
 
     def testCommitList(self):
@@ -601,7 +724,1652 @@ class OrganizationTest(BaseCase):
         self.assertEquals('integrity', o.name)
 
 
+class AsyncTest(BaseCase):
+
+    COLLABS = ('<?xml version="1.0" encoding="UTF-8"?>'
+               '<collaborators type="array">'
+               '<collaborator>dustin</collaborator>'
+               '<collaborator>%s</collaborator>'
+               '</collaborators>')
+
+    def testShow(self):
+        """Calls return futures of the usual objects."""
+        def opener(url, data=None):
+            self.assertEquals('https://github.com/api/v2/xml/repos/show/schacon/grit',
+                              url)
+            return open('data/repo.xml')
+        f = github.AsyncGitHub(fetcher=opener).repos.show('schacon', 'grit')
+        self.assertEquals('grit', f.result().name)
+
+    def testCollaboratorsAll(self):
+        """Collaborators of every repo are fetched concurrently."""
+        seen = []
+        lock = threading.Lock()
+        gate = threading.Event()
+        def opener(url, data=None):
+            if '/collaborators' not in url:
+                return open('data/repos.xml')
+            lock.acquire()
+            seen.append(url)
+            if len(seen) == 10:
+                gate.set()
+            lock.release()
+            # Every collaborator request must be in flight at once.
+            gate.wait(5)
+            self.assertTrue(gate.isSet())
+            return StringIO.StringIO(self.COLLABS % url.split('/')[-2])
+        gh = github.AsyncGitHub('verbal', None, fetcher=opener, concurrency=10)
+        rv = gh.repos.collaborators_all().result(10)
+        self.assertEquals(10, len(rv))
+        self.assertEquals(['dustin', 'wokkel'], rv['wokkel'])
+
+    def testOptions(self):
+        """GitHub's options are accepted too."""
+        def opener(url, data=None):
+            return open('data/issues.list.xml')
+        gh = github.AsyncGitHub(fetcher=opener, lazy=True, dates=True,
+                                coalesce=False, interning=True)
+        i = gh.issues.list('schacon', 'simplegit').result()[0]
+        self.assertEquals(dates.parse('2009-04-17T16:18:50-07:00'),
+                          i.created_at)
+        self.assertRaises(ValueError, github.AsyncGitHub, api='v4')
+
+    def testFailure(self):
+        """Errors are raised from result()."""
+        def opener(url, data=None):
+            raise IOError("broken")
+        f = github.AsyncGitHub(fetcher=opener).users.show('dustin')
+        self.assertRaises(IOError, f.result)
+
+class BatchTest(unittest.TestCase):
+
+    def _gh(self, urls, delay=0, **kwargs):
+        lock = threading.Lock()
+        self.running = [0, 0]
+        def opener(url, data=None):
+            lock.acquire()
+            urls.append(url)
+            self.running[0] += 1
+            self.running[1] = max(self.running)
+            lock.release()
+            time.sleep(delay)
+            lock.acquire()
+            self.running[0] -= 1
+            lock.release()
+            if '/missing' in url:
+                raise hclient.HTTPError(url, 404, 'Not Found', {}, None)
+            if 'user/show' in url:
+                return open('data/user.public.xml')
+            return open('data/repo.xml')
+        return github.GitHub(fetcher=opener, **kwargs)
+
+    def testBatch(self):
+        """Calls run together, concurrently, when the block ends."""
+        urls = []
+        gh = self._gh(urls, delay=0.02)
+        with gh.batch(concurrency=3):
+            repos = [gh.repos.show('schacon', 'grit%d' % i) for i in range(6)]
+            user = gh.users.show('dustin')
+            self.assertEquals([], urls)
+            self.assertFalse(user.done())
+        self.assertEquals(7, len(urls))
+        self.assertEquals(3, self.running[1])
+        self.assertEquals('grit', repos[5].result().name)
+        self.assertEquals('dustin', user.result().login)
+        self.assertEquals('grit', gh.repos.show('schacon', 'grit').name)
+
+    def testDefaultPool(self):
+        """The default connection pool allows the batch's concurrency."""
+        size = hclient._pool.maxPerHost
+        try:
+            with self._gh([]).batch(concurrency=size + 16):
+                pass
+            self.assertEquals(size + 16, hclient._pool.maxPerHost)
+        finally:
+            hclient._pool.maxPerHost = size
+
+    def testDuplicates(self):
+        """Identical calls share one request."""
+        urls = []
+        gh = self._gh(urls, coalesce=False)
+        with gh.batch():
+            a = gh.repos.show('schacon', 'grit')
+            b = gh.repos.show('schacon', 'grit')
+            c = gh.repos.show('schacon', 'other')
+        self.assertTrue(a is b)
+        self.assertFalse(a is c)
+        self.assertEquals(2, len(urls))
+
+    def testDuplicateWrites(self):
+        """Identical writes each run."""
+        urls = []
+        gh = self._gh(urls, coalesce=False)
+        with gh.batch():
+            a = gh.repos.addCollaborator('grit', 'schacon')
+            b = gh.repos.addCollaborator('grit', 'schacon')
+        self.assertFalse(a is b)
+        self.assertEquals(2, len(urls))
+
+    def testFailure(self):
+        """A failed call fails only its own future."""
+        urls = []
+        gh = self._gh(urls)
+        with gh.batch():
+            ok = gh.repos.show('schacon', 'grit')
+            missing = gh.repos.show('schacon', 'missing')
+        self.assertEquals('grit', ok.result().name)
+        self.assertRaises(hclient.HTTPError, missing.result)
+
+    def testCancelled(self):
+        """Nothing runs if the block raises."""
+        urls = []
+        gh = self._gh(urls)
+        try:
+            with gh.batch():
+                f = gh.repos.show('schacon', 'grit')
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEquals([], urls)
+        self.assertTrue(f.cancelled())
+        self.assertEquals('grit', gh.repos.show('schacon', 'grit').name)
+
+    def testOtherThreads(self):
+        """Only the thread in the block has its calls batched."""
+        urls = []
+        gh = self._gh(urls)
+        rv = []
+        with gh.batch():
+            f = gh.repos.show('schacon', 'grit')
+            t = threading.Thread(
+                target=lambda: rv.append(gh.users.show('dustin')))
+            t.start()
+            t.join()
+            self.assertEquals(1, len(urls))
+        self.assertEquals('dustin', rv[0].login)
+        self.assertEquals('grit', f.result().name)
+
+class StreamParserTest(unittest.TestCase):
+
+    def _dom(self, doc):
+        return github._parse(xml.dom.minidom.parseString(doc).documentElement)
+
+    def _stream(self, doc, chunk=100):
+        p = github._StreamParser(github._types)
+        for i in range(0, len(doc), chunk):
+            p.feed(doc[i:i + chunk])
+        return p.close()
+
+    def _plain(self, v):
+        """Reduce parsed values to comparable builtins."""
+        if isinstance(v, list):
+            return [self._plain(i) for i in v]
+        if isinstance(v, github.BaseResponse):
+            return (v.__class__,
+                    dict((k, self._plain(i)) for k, i in v._asdict().items()))
+        return (type(v), v)
+
+    def testSameObjects(self):
+        """Streaming builds exactly what the DOM parser builds."""
+        for fn in ['repos.xml', 'repos.search.xml', 'repo.xml', 'commits.xml',
+                   'commits.file.xml', 'issues.list.xml', 'issues.show.xml',
+                   'user.search.xml', 'user.private.xml', 'keys.xml',
+                   'network.xml', 'org.repos.public.xml', 'orgs.repos.xml',
+                   'org.members.public.xml']:
+            doc = open('data/' + fn).read()
+            self.assertEquals(self._plain(self._dom(doc)),
+                              self._plain(self._stream(doc)), fn)
+
+    def testLazySameObjects(self):
+        """Lazily built responses hold the same values once used."""
+        for fn in ['repos.xml', 'repos.search.xml', 'repo.xml', 'commits.xml',
+                   'commits.file.xml', 'issues.list.xml', 'issues.show.xml',
+                   'user.search.xml', 'user.private.xml', 'keys.xml',
+                   'network.xml', 'org.repos.public.xml', 'orgs.repos.xml',
+                   'org.members.public.xml']:
+            doc = open('data/' + fn).read()
+            for chunk in (100, len(doc)):
+                p = github._StreamParser(github._types, lazy=True)
+                for i in range(0, len(doc), chunk):
+                    p.feed(doc[i:i + chunk])
+                self.assertEquals(self._plain(self._stream(doc)),
+                                  self._plain(p.close()), fn)
+
+    def testLazyText(self):
+        """Lazy fields are unescaped and converted like any other."""
+        doc = ('<?xml version="1.0" encoding="ISO-8859-1"?>'
+               '<repository><name>a &amp; b&#233;\r\n</name>'
+               '<forks type="integer">3</forks><owner/><homepage></homepage>'
+               '<mixed>x<!-- y --></mixed><plan><name>free</name></plan>'
+               '</repository>')
+        doc = doc.replace('&#233;', '\xe9')
+        p = github._StreamParser(github._types, lazy=True)
+        p.feed(doc)
+        r = p.close()
+        self.assertEquals(u'a & b\xe9\n', r.name)
+        self.assertEquals(3, r.forks)
+        self.assertFalse(hasattr(r, 'owner'))
+        self.assertFalse(hasattr(r, 'homepage'))
+        # Mixed content can't be parsed, but only fails when it's used.
+        self.assertRaises(Exception, getattr, r, 'mixed')
+        self.assertEquals('Plan', r.plan.__class__.__name__)
+        self.assertEquals('free', r.plan.name)
+        self.assertFalse(hasattr(r, 'nothing'))
+
+    def testLazyCaches(self):
+        """Lazy fields are converted when first used, and kept."""
+        p = github._StreamParser(github._types, lazy=True)
+        p.feed(open('data/repo.xml').read())
+        r = p.close()
+        slot = github.Repository.watchers
+        self.assertRaises(AttributeError, slot.__get__, r)
+        self.assertEquals(68, r.watchers)
+        self.assertEquals(68, slot.__get__(r))
+        r.name = 'other'
+        self.assertEquals('other', r._asdict()['name'])
+        self.assertEquals(None, r._raw)
+
+    def testLazyDefaults(self):
+        """Class defaults don't hide lazy fields."""
+        doc = ('<public-keys type="array"><public-key><title>mine</title>'
+               '<id type="integer">1</id></public-key><public-key>'
+               '<id type="integer">2</id></public-key></public-keys>')
+        p = github._StreamParser(github._types, lazy=True)
+        p.feed(doc)
+        keys = p.close()
+        self.assertEquals(['mine', 'untitled'], [k.title for k in keys])
+
+    def testUnusedChildErrors(self):
+        """Children the DOM parser would never look at can't fail."""
+        doc = ('<repository><name type="string">x<junk><a>1</a><b>2</b>'
+               '</junk></name></repository>')
+        self.assertEquals('x', self._stream(doc).name)
+        self.assertEquals('x', self._dom(doc).name)
+
+    def testErrors(self):
+        """Unparseable containers fail the same way."""
+        doc = '<repository><junk><a>1</a><b>2</b></junk></repository>'
+        self.assertRaises(Exception, self._dom, doc)
+        self.assertRaises(Exception, self._stream, doc)
+
+    def testTypeChild(self):
+        """Containers typed by a <type> child still parse."""
+        doc = ('<things type="array"><thing><type>user</type>'
+               '<login>dustin</login></thing><thing>x</thing></things>')
+        for parse in (self._dom, self._stream):
+            rv = parse(doc)
+            self.assertEquals('User', rv[0].__class__.__name__)
+            self.assertEquals('dustin', rv[0].login)
+            self.assertEquals('x', rv[1])
+
+    def testFailedItem(self):
+        """A bad item fails the array it's in."""
+        doc = ('<repositories type="array"><repository><name>a</name>'
+               '</repository><repository><junk><a>1</a><b>2</b></junk>'
+               '</repository></repositories>')
+        self.assertRaises(Exception, self._stream, doc)
+
+    def testBuildersReused(self):
+        """Builders are worked out once per shape and type table."""
+        types = dict(github._types)
+        doc = open('data/repos.xml').read()
+        p = github._StreamParser(types)
+        p.feed(doc)
+        p.close()
+        builders = dict(github._buildersFor(types))
+        self.assertTrue(('repository', None) in builders)
+        p = github._StreamParser(types)
+        p.feed(doc)
+        p.close()
+        self.assertEquals(builders, github._buildersFor(types))
+
+class ModelTest(unittest.TestCase):
+
+    def testKnownFieldsUseSlots(self):
+        """Fields a model declares don't need an instance dict."""
+        doc = '<repository><name>grit</name><owner>mojombo</owner></repository>'
+        r = github._StreamParser(github._types)
+        r.feed(doc)
+        r = r.close()
+        self.assertEquals('grit', r.name)
+        self.assertEquals({}, r.__dict__)
+        self.assertEquals({'name': 'grit', 'owner': 'mojombo'}, r._asdict())
+
+    def testUnknownFields(self):
+        """Fields a model doesn't declare still show up."""
+        doc = ('<user><login>dustin</login>'
+               '<shoe-size type="integer">11</shoe-size></user>')
+        u = github._parse(xml.dom.minidom.parseString(doc).documentElement)
+        self.assertEquals(11, u.shoe_size)
+        self.assertEquals({'shoe_size': 11}, u.__dict__)
+        self.assertEquals({'login': 'dustin', 'shoe_size': 11}, u._asdict())
+
+    def testMissingField(self):
+        """Declared fields github didn't send are missing, not None."""
+        doc = '<repository><name>grit</name><username>mojombo</username>' \
+            '</repository>'
+        r = github._parse(xml.dom.minidom.parseString(doc).documentElement)
+        self.assertFalse(hasattr(r, 'owner'))
+        self.assertEquals('mojombo', r.owner_name)
+
+    def testDefaults(self):
+        """Class defaults still apply until github sends a value."""
+        k = github.PublicKey._fromPairs([('id', 1)])
+        self.assertEquals('untitled', k.title)
+        k = github.PublicKey._fromPairs([('id', 1), ('title', 'mine')])
+        self.assertEquals('mine', k.title)
+
+    def testPickle(self):
+        """Models survive pickling and copying."""
+        c = github.Commit._fromPairs([('id', 'abc'), ('extra', 1)])
+        for proto in range(pickle.HIGHEST_PROTOCOL + 1):
+            p = pickle.loads(pickle.dumps(c, proto))
+            self.assertEquals(c._asdict(), p._asdict())
+        self.assertEquals('abc', copy.copy(c).id)
+
+    def testLazy(self):
+        """Lazy responses act like any other."""
+        def opener(url, data=None):
+            return open('data/repos.xml')
+        repos = github.GitHub(fetcher=opener, lazy=True).repos.forUser('x')
+        self.assertEquals('Repository', repos[0].__class__.__name__)
+        self.assertEquals(('verbal', 'beanstalk-client-twisted'),
+                          (repos[0].owner_name, repos[0].name))
+        p = pickle.loads(pickle.dumps(repos[1]))
+        self.assertEquals(repos[1]._asdict(), p._asdict())
+
+    def testMissingAttribute(self):
+        """Missing attributes are reported by name, lazy or not."""
+        def opener(url, data=None):
+            return open('data/repo.xml')
+        for lazy in (False, True):
+            repo = github.GitHub(fetcher=opener,
+                                 lazy=lazy).repos.show('schacon', 'grit')
+            try:
+                repo.nonexistent
+                self.fail("Expected an AttributeError")
+            except AttributeError, e:
+                self.assertEquals(('nonexistent',), e.args)
+        self.assertRaises(AttributeError, getattr,
+                          github.Repository._fromPairs([]), 'nonexistent')
+
+class InternTest(unittest.TestCase):
+
+    def _commits(self, **kwargs):
+        def opener(url, data=None):
+            return open('data/commits.xml')
+        gh = github.GitHub(fetcher=opener, coalesce=False, **kwargs)
+        return gh.commits.forBranch('dustin', 'py-github')
+
+    def testPool(self):
+        pool = github.InternPool(maxSize=2)
+        a = u''.join([u'x', u'y'])
+        self.assertTrue(pool.intern(a) is a)
+        self.assertTrue(pool.intern(u''.join([u'x', u'y'])) is a)
+        pool.intern(u'b')
+        c = u''.join([u'c', u'd'])
+        self.assertTrue(pool.intern(c) is c)
+        self.assertTrue(pool.intern(u''.join([u'c', u'd'])) is not c)
+        self.assertEquals(2, len(pool))
+
+    def testOff(self):
+        commits = self._commits()
+        self.assertEquals(commits[0].author.email, commits[1].author.email)
+        self.assertFalse(commits[0].author.email is commits[1].author.email)
+
+    def testPerResponse(self):
+        """Equal interned fields of one response share a value."""
+        for lazy in (False, True):
+            commits = self._commits(interning=True, lazy=lazy)
+            emails = set(id(c.author.email) for c in commits)
+            self.assertEquals(len(set(c.author.email for c in commits)),
+                              len(emails))
+            other = self._commits(interning=True, lazy=lazy)
+            self.assertFalse(other[0].author.email is commits[0].author.email)
+            # Fields that aren't interned aren't shared.
+            self.assertFalse(commits[0].tree is other[0].tree)
+
+    def testShared(self):
+        """An InternPool shares values across responses."""
+        pool = github.InternPool()
+        commits = self._commits(interning=pool)
+        other = self._commits(interning=pool)
+        self.assertTrue(other[0].author.email is commits[0].author.email)
+        self.assertTrue(other[0].committed_date is commits[0].committed_date)
+        self.assertTrue(len(pool) > 0)
+
+class DatesTest(unittest.TestCase):
+
+    def testParse(self):
+        d = dates.parse('2009-04-17T16:19:02-07:00')
+        self.assertEquals((2009, 4, 17, 16, 19, 2), d.timetuple()[:6])
+        self.assertEquals(-7 * 3600, d.utcoffset().days * 86400
+                          + d.utcoffset().seconds)
+        self.assertEquals(d, dates.parse('2009-04-17T23:19:02Z'))
+        self.assertEquals(d, dates.parse('2009/04/17 16:19:02 -0700'))
+        self.assertEquals(500000,
+                          dates.parse('2009-04-17T23:19:02.5Z').microsecond)
+        self.assertRaises(ValueError, dates.parse, 'yesterday')
+        self.assertRaises(ValueError, dates.parse, '2009-04-17T23:19:02 PST')
+
+    def testCached(self):
+        s = '2009-04-17T16:19:02-07:00'
+        self.assertTrue(dates.parse(s) is dates.parse(s[:] + ''))
+
+    def testPickle(self):
+        d = dates.parse('2009-04-17T16:19:02-07:00')
+        self.assertEquals(d.utcoffset(),
+                          pickle.loads(pickle.dumps(d)).utcoffset())
+
+    def testEpochs(self):
+        items = [github.Commit._fromPairs([('committed_date', v)])
+                 for v in ['1970-01-01T00:01:00Z', None,
+                           dates.parse('1970-01-01T01:00:00+01:00')]]
+        items.append(github.Commit._fromPairs([]))
+        e = dates.epochs(items, 'committed_date')
+        self.assertEquals(60.0, e[0])
+        self.assertTrue(e[1] != e[1])
+        self.assertEquals(0.0, e[2])
+        self.assertTrue(e[3] != e[3])
+
+    def testEndpoints(self):
+        """Endpoints asked to parse timestamps into datetimes do."""
+        def opener(url, data=None, **kwargs):
+            return open('data/' + files.pop(0))
+        for lazy in (False, True):
+            files = ['commits.xml', 'issues.list.xml']
+            gh = github.GitHub(fetcher=opener, dates=True, lazy=lazy)
+            c = gh.commits.forBranch('dustin', 'py-github')[0]
+            self.assertEquals(dates.parse(c.committed_date.isoformat()),
+                              c.committed_date)
+            self.assertEquals(2009, c.authored_date.year)
+            i = gh.issues.list('schacon', 'simplegit')[0]
+            self.assertEquals(dates.parse('2009-04-17T16:18:50-07:00'),
+                              i.created_at)
+        files = ['v3.issues.json']
+        i = github.GitHub(fetcher=opener, dates=True,
+                          api='v3').issues.list('schacon', 'simplegit')[0]
+        self.assertEquals(dates.parse('2009-04-17T23:18:50Z'), i.created_at)
+        self.assertEquals(None, i.closed_at)
+
+    def testOff(self):
+        def opener(url, data=None):
+            return open('data/issues.list.xml')
+        i = github.GitHub(fetcher=opener).issues.list('schacon', 'simplegit')
+        self.assertEquals('2009-04-17T16:18:50-07:00', i[0].created_at)
+
+class ColumnsTest(unittest.TestCase):
+
+    def _repos(self, **kwargs):
+        def opener(url, data=None):
+            return open('data/repos.xml')
+        return github.GitHub(fetcher=opener, **kwargs).repos.forUser('dustin')
+
+    def testTypes(self):
+        repos = self._repos()
+        cols = columns.columns(repos)
+        self.assertEquals([r.watchers for r in repos], list(cols['watchers']))
+        self.assertEquals([r.fork for r in repos],
+                          [bool(f) for f in cols['fork']])
+        self.assertEquals([r.name for r in repos], list(cols['name']))
+        self.assertEquals(['verbal'], cols['owner'].values)
+        self.assertEquals([0] * len(repos), list(cols['owner'].codes))
+
+    def testArrays(self):
+        """Without numpy, columns are array.arrays."""
+        numpy, columns.numpy = columns.numpy, None
+        try:
+            cols = columns.columns(self._repos())
+        finally:
+            columns.numpy = numpy
+        self.assertEquals('l', cols['forks'].typecode)
+        self.assertEquals('b', cols['fork'].typecode)
+        self.assertEquals('i', cols['name'].codes.typecode)
+
+    def testMissing(self):
+        """Missing values are NaN or -1, and new fields are padded."""
+        items = [github.Issue._fromPairs([('number', 1), ('user', 'a')]),
+                 github.Issue._fromPairs([('votes', 2)]),
+                 github.Issue._fromPairs([('number', 2.5),
+                                          ('created_at',
+                                           '1970-01-01T00:01:00Z')])]
+        cols = columns.columns(items)
+        self.assertEquals(1.0, cols['number'][0])
+        self.assertTrue(cols['number'][1] != cols['number'][1])
+        self.assertEquals(2.5, cols['number'][2])
+        self.assertEquals(['a', None, None], list(cols['user']))
+        self.assertEquals(-1, cols['user'].codes[1])
+        self.assertTrue(cols['votes'][0] != cols['votes'][0])
+        self.assertEquals(2, cols['votes'][1])
+        self.assertEquals(60, cols['created_at'][2])
+
+    def testFields(self):
+        """Only the named fields are collected, including nested ones."""
+        def opener(url, data=None):
+            return open('data/commits.xml')
+        commits = github.GitHub(fetcher=opener,
+                                lazy=True).commits.forBranch('dustin',
+                                                             'py-github')
+        cols = columns.columns(commits, ['author.name', 'committed_date'])
+        self.assertEquals(['author.name', 'committed_date'], sorted(cols))
+        self.assertEquals(commits[0].author.name, cols['author.name'][0])
+        self.assertEquals(int(dates.epoch(commits[0].committed_date)),
+                          cols['committed_date'][0])
+        self.assertFalse('message' in commits[1].__dict__)
+
+    def testStreaming(self):
+        """Columns can be built straight from a stream."""
+        cols = columns.columns(self._repos(streaming=True), ['name'])
+        self.assertEquals([r.name for r in self._repos()],
+                          list(cols['name']))
+
+class TypeMappingTest(unittest.TestCase):
+
+    def testCallsDontShareMappings(self):
+        """A call's temporary mappings aren't seen by other calls."""
+        seen = []
+        def opener(url, data=None):
+            seen.append('blob' in github._types)
+            if '/blob/' in url:
+                # Parse another document while the blob call is running.
+                seen.append(gh.repos.show('schacon', 'grit'))
+                return open('data/blob.xml')
+            return open('data/repo.xml')
+        gh = github.GitHub(fetcher=opener)
+        blob = gh.objects.blob('defunkt', 'github-gem', 'sha', 'setup.py')
+        self.assertEquals('Blob', blob.__class__.__name__)
+        self.assertEquals([False, False], seen[:2])
+        self.assertEquals('grit', seen[2].name)
+        self.assertFalse('blob' in github._types)
+
+    def testKeywordArguments(self):
+        """Decorated methods take keyword arguments and keep their docs."""
+        urls = []
+        def opener(url, data=None):
+            urls.append(url)
+            return open('data/issues.list.xml')
+        gh = github.GitHub(fetcher=opener)
+        self.assertEquals(1, len(gh.issues.list('u', 'r', state='closed')))
+        self.assertTrue(urls[0].endswith('issues/list/u/r/closed'))
+        for ep in (gh.issues, github.AsyncGitHub().issues):
+            self.assertEquals('list', ep.list.__name__)
+            self.assertEquals(github.IssuesEndpoint.list.__doc__,
+                              ep.list.__doc__)
+        self.assertTrue(gh.issues.list.__doc__)
+
+    def testConcurrentCalls(self):
+        """Calls with different mappings can run in parallel."""
+        def opener(url, data=None):
+            time.sleep(0.001)
+            if '/tree/' in url:
+                return open('data/tree.xml')
+            return open('data/issues.list.xml')
+        gh = github.GitHub(fetcher=opener, coalesce=False)
+        errors = []
+        def tree():
+            assert gh.objects.tree('a', 'b', 'c')['.gitignore'].type == 'blob'
+        def issues():
+            assert isinstance(gh.issues.list('a', 'b')[0].user, basestring)
+        def run(fn):
+            try:
+                for i in range(20):
+                    fn()
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target=run, args=(f,))
+                   for f in [tree, issues] * 3]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEquals([], errors)
+
+class V3Test(unittest.TestCase):
+
+    def _gh(self, fn, **kwargs):
+        self.urls = []
+        def opener(url, data=None, **kwargs):
+            self.urls.append(url)
+            return open('data/' + fn)
+        return github.GitHub(fetcher=opener, api='v3', **kwargs)
+
+    def testUnknownAPI(self):
+        self.assertRaises(ValueError, github.GitHub, api='v4')
+
+    def testUser(self):
+        u = self._gh('v3.user.json').users.show('dustin')
+        self.assertEquals(['https://api.github.com/users/dustin'], self.urls)
+        self.assertEquals('User', u.__class__.__name__)
+        self.assertEquals('Dustin Sallings', u.name)
+        self.assertEquals(258, u.public_repo_count)
+        self.assertEquals(1012, u.followers_count)
+
+    def testRepos(self):
+        repos = self._gh('v3.repos.json').repos.forUser('dustin', page=2)
+        self.assertEquals(['https://api.github.com/users/dustin/repos'
+                           '?page=2&per_page=100'],
+                          self.urls)
+        self.assertEquals(['py-github', 'memcached'], [r.name for r in repos])
+        r = repos[0]
+        self.assertEquals('dustin', r.owner)
+        self.assertEquals('dustin', r.owner_name)
+        self.assertEquals('https://github.com/dustin/py-github', r.url)
+        self.assertEquals(128, r.watchers)
+        self.assertEquals(42, r.forks)
+        self.assertEquals('master', r.master_branch)
+        self.assertFalse(r.private)
 
+    def testOwnRepos(self):
+        """Your own repos include the private ones when logged in."""
+        gh = self._gh('v3.repos.json')
+        gh.user, gh.token = 'dustin', 'sekrit'
+        gh.repos.forUser('dustin')
+        gh.repos.forUser('schacon')
+        gh.token = None
+        gh.repos.forUser('dustin')
+        q = '?page=1&per_page=100'
+        self.assertEquals(['https://api.github.com/user/repos' + q,
+                           'https://api.github.com/users/schacon/repos' + q,
+                           'https://api.github.com/users/dustin/repos' + q],
+                          self.urls)
+
+    def testCommits(self):
+        commits = self._gh('v3.commits.json').commits.forBranch(
+            'dustin', 'py-github', 'master')
+        self.assertEquals(['https://api.github.com/repos/dustin/py-github/'
+                           'commits?page=1&per_page=100&sha=master'],
+                          self.urls)
+        c = commits[0]
+        self.assertEquals('4b8d8f5ba4f7a5e8c0e4b2d7f9e0a1b2c3d4e5f6', c.id)
+        self.assertEquals('Added a thing.', c.message)
+        self.assertEquals('Author', c.author.__class__.__name__)
+        self.assertEquals('dustin@spy.net', c.author.email)
+        self.assertEquals('dustin', c.author.login)
+        self.assertEquals('2011-04-05T06:29:29Z', c.authored_date)
+        self.assertEquals('2011-04-05T06:30:00Z', c.committed_date)
+        self.assertEquals(['7a1c2e3f4a5b6c7d8e9f0a1b2c3d4e5f6a7b8c9d'],
+                          [p.id for p in c.parents])
+        self.assertEquals([], commits[1].parents)
+
+    def testCommit(self):
+        c = self._gh('v3.commit.json').commits.show('dustin', 'py-github',
+                                                    '4b8d8f5b')
+        self.assertEquals(['github/new.py'], c.added)
+        self.assertEquals(['github/old.py'], c.removed)
+        self.assertEquals(['github/github.py'],
+                          [m.filename for m in c.modified])
+        self.assertEquals('@@ -1 +1 @@\n-a\n+b', c.modified[0].diff)
+
+    def testIssues(self):
+        issues = self._gh('v3.issues.json').issues.list('schacon',
+                                                        'simplegit')
+        self.assertEquals(['https://api.github.com/repos/schacon/simplegit/'
+                           'issues?per_page=100&state=open'], self.urls)
+        i = issues[0]
+        self.assertEquals(2, i.number)
+        self.assertEquals('schacon', i.user)
+        self.assertEquals(['bug'], [l.name for l in i.labels])
+
+    def testLinkedPages(self):
+        """Lists follow the Link header through every page."""
+        self.urls = []
+        def opener(url, data=None, **kwargs):
+            self.urls.append(url)
+            headers = {}
+            if len(self.urls) == 1:
+                headers['link'] = ('<https://api.github.com/repositories/1/'
+                                   'forks?per_page=100&page=2>; '
+                                   'rel="next", <https://api.github.com/'
+                                   'repositories/1/forks?'
+                                   'per_page=100&page=2>; rel="last"')
+            return HeaderResponse(open('data/v3.repos.json').read(), headers)
+        gh = github.GitHub(fetcher=opener, api='v3')
+        forks = gh.repos.network('dustin', 'py-github')
+        self.assertEquals(['https://api.github.com/repos/dustin/py-github/'
+                           'forks?per_page=100',
+                           'https://api.github.com/repositories/1/'
+                           'forks?per_page=100&page=2'], self.urls)
+        self.assertEquals(['py-github', 'memcached'] * 2,
+                          [f.name for f in forks])
+
+    def testTree(self):
+        t = self._gh('v3.tree.json').objects.tree('dustin', 'py-github',
+                                                  'master')
+        self.assertEquals(['.gitignore', 'lib'], sorted(t.keys()))
+        self.assertEquals('blob', t['.gitignore'].type)
+        self.assertEquals('100644', t['.gitignore'].mode)
+
+    def testWritesStayOnV2(self):
+        """Calls without a v3 version still use v2."""
+        gh = self._gh('v3.user.json')
+        gh.repos.addCollaborator('memcached', 'trondn')
+        self.assertTrue(self.urls[0].startswith(github.BaseEndpoint.BASE_URL))
+
+class StreamingTest(unittest.TestCase):
+
+    def _gh(self, fn, responses=None, **kwargs):
+        def opener(url, data=None):
+            rv = StringIO.StringIO(open('data/' + fn).read())
+            if responses is not None:
+                responses.append(rv)
+            return rv
+        return github.GitHub(fetcher=opener, streaming=True, **kwargs)
+
+    def testItemsBeforeEnd(self):
+        """Items of an array come out before the body has been read."""
+        responses = []
+        size, github._CHUNK_SIZE = github._CHUNK_SIZE, 512
+        try:
+            repos = self._gh('repos.xml', responses).repos.forUser('dustin')
+            first = repos.next()
+        finally:
+            github._CHUNK_SIZE = size
+        self.assertEquals('Repository', first.__class__.__name__)
+        self.assertTrue(responses[0].tell() < len(responses[0].getvalue()))
+
+    def testSameItems(self):
+        """Streaming yields the same items as the list."""
+        def opener(url, data=None):
+            return open('data/repos.xml')
+        expected = github.GitHub(fetcher=opener).repos.forUser('dustin')
+        got = list(self._gh('repos.xml').repos.forUser('dustin'))
+        self.assertEquals([r.name for r in expected], [r.name for r in got])
+        self.assertEquals(len(expected), len(got))
+
+    def testNotArray(self):
+        """Documents that aren't arrays still come back whole."""
+        repo = self._gh('repo.xml').repos.show('schacon', 'grit')
+        self.assertEquals('grit', repo.name)
+
+    def testTemporaryMappings(self):
+        """Mappings an endpoint adds apply to the streamed items."""
+        tree = self._gh('tree.xml').objects.tree('defunkt', 'github-gem',
+                                                 'master')
+        self.assertEquals('100644', tree['.gitignore'].mode)
+
+    def testReportedWhenRead(self):
+        """Events for streamed arrays are sent once they're used up."""
+        gh = self._gh('repos.xml')
+        events = []
+        gh.subscribe(events.append)
+        repos = gh.repos.forUser('dustin')
+        self.assertEquals([], events)
+        n = len(list(repos))
+        self.assertEquals(1, len(events))
+        self.assertEquals(os.path.getsize('data/repos.xml'),
+                          events[0]['bytes'])
+        self.assertTrue(n > 0)
+
+    def testClose(self):
+        """Closing a stream early closes the response and reports it."""
+        responses = []
+        size, github._CHUNK_SIZE = github._CHUNK_SIZE, 512
+        try:
+            gh = self._gh('repos.xml', responses)
+            events = []
+            gh.subscribe(events.append)
+            repos = gh.repos.forUser('dustin')
+            repos.next()
+            repos.close()
+        finally:
+            github._CHUNK_SIZE = size
+        self.assertTrue(responses[0].closed)
+        self.assertEquals(1, len(events))
+        self.assertRaises(StopIteration, repos.next)
+        repos.close()
+        self.assertEquals(1, len(events))
+
+    def testDropped(self):
+        """A stream dropped part way through is closed."""
+        responses = []
+        size, github._CHUNK_SIZE = github._CHUNK_SIZE, 512
+        try:
+            gh = self._gh('repos.xml', responses)
+            events = []
+            gh.subscribe(events.append)
+            for repo in gh.repos.forUser('dustin'):
+                break
+            del repo
+        finally:
+            github._CHUNK_SIZE = size
+        self.assertTrue(responses[0].closed)
+        self.assertEquals(1, len(events))
+
+    def testCollaboratorsAll(self):
+        """Composite calls return lists, not streams."""
+        def opener(url, data=None):
+            if '/collaborators' not in url:
+                return repoPages(url)
+            return StringIO.StringIO(AsyncTest.COLLABS % url.split('/')[-2])
+        for cls in (github.GitHub, github.AsyncGitHub):
+            gh = cls('verbal', None, fetcher=opener, streaming=True)
+            rv = gh.repos.collaborators_all()
+            if cls is github.AsyncGitHub:
+                rv = rv.result(5)
+            self.assertEquals(['dustin', 'wokkel'], rv['wokkel'])
+
+class PaginationTest(unittest.TestCase):
+
+    def _gh(self, pages, **kwargs):
+        """A GitHub serving repos.xml for the given pages, and nothing
+        after them."""
+        self.urls = []
+        def opener(url, data=None):
+            self.urls.append(url)
+            page = int(url.split('page=')[1].split('&')[0])
+            if page in pages:
+                return open('data/repos.xml')
+            return StringIO.StringIO('<repositories type="array"/>')
+        return github.GitHub(fetcher=opener, **kwargs)
+
+    def _pages(self):
+        return sorted(int(u.split('page=')[1]) for u in self.urls)
+
+    def testAllPages(self):
+        gh = self._gh([1, 2, 3])
+        one = gh.repos.forUser('verbal')
+        repos = list(gh.repos.iterForUser('verbal', prefetch=0))
+        self.assertEquals([r.name for r in one] * 3, [r.name for r in repos])
+        self.assertEquals([1, 1, 2, 3, 4], self._pages())
+
+    def testPrefetch(self):
+        """The next pages are requested before the current one is used."""
+        gh = self._gh([1, 2, 3])
+        repos = gh.repos.iterForUser('verbal', prefetch=2)
+        repos.next()
+        deadline = time.time() + 5
+        while len(self.urls) < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEquals([1, 2, 3], self._pages())
+        self.assertEquals(30, 1 + len(list(repos)))
+
+    def testPastTheEnd(self):
+        """No more than prefetch pages are requested past the last."""
+        gh = self._gh([1])
+        self.assertEquals(10, len(list(gh.repos.iterForUser('verbal',
+                                                           prefetch=2))))
+        time.sleep(0.1)
+        self.assertEquals([1, 2, 3, 4], self._pages())
+
+    def testStart(self):
+        gh = self._gh([2])
+        repos = list(gh.repos.iterForUser('verbal', page=2, prefetch=0))
+        self.assertEquals(10, len(repos))
+        self.assertEquals([2, 3], self._pages())
+
+    def testShortPage(self):
+        """A page shorter than the first is the last."""
+        def opener(url, data=None):
+            self.urls.append(url)
+            if 'page=1' in url:
+                return open('data/commits.xml')
+            doc = xml.dom.minidom.parse('data/commits.xml')
+            el = doc.documentElement
+            el.removeChild(el.getElementsByTagName('commit')[0])
+            return StringIO.StringIO(doc.toxml('utf-8'))
+        self.urls = []
+        gh = github.GitHub(fetcher=opener)
+        n = len(gh.commits.forBranch('dustin', 'py-github'))
+        commits = list(gh.commits.iterForBranch('dustin', 'py-github',
+                                                prefetch=0))
+        self.assertEquals(n * 2 - 1, len(commits))
+        self.assertEquals(3, len(self.urls))
+
+    def testError(self):
+        """A failed page ends iteration with its error."""
+        def opener(url, data=None):
+            if 'page=1' in url:
+                return open('data/repos.xml')
+            raise hclient.HTTPError(url, 500, 'Oops', {}, None)
+        gh = github.GitHub(fetcher=opener)
+        repos = gh.repos.iterForUser('verbal')
+        self.assertEquals(10, len([repos.next() for i in range(10)]))
+        self.assertRaises(hclient.HTTPError, repos.next)
+
+    def testWindow(self):
+        """Pages are fetched window at a time and come back in order."""
+        body = open('data/repos.xml').read()
+        lock = threading.Lock()
+        running = [0, 0]
+        def opener(url, data=None):
+            page = int(url.split('page=')[1])
+            lock.acquire()
+            running[0] += 1
+            running[1] = max(running)
+            lock.release()
+            # Later pages answer first.
+            time.sleep(0.05 / page)
+            lock.acquire()
+            running[0] -= 1
+            lock.release()
+            if page > 5:
+                return StringIO.StringIO('<repositories type="array"/>')
+            return StringIO.StringIO(body.replace('<owner>verbal',
+                                                  '<owner>p%d' % page))
+        gh = github.GitHub(fetcher=opener)
+        repos = gh.repos.forUser('verbal', window=3)
+        self.assertEquals(50, len(repos))
+        self.assertEquals(['p%d' % (i / 10 + 1) for i in range(50)],
+                          [r.owner for r in repos])
+        self.assertEquals(3, running[1])
+
+    def testWindowShortPage(self):
+        gh = self._gh([1, 2])
+        repos = gh.repos.forUser('verbal', page=2, window=4)
+        self.assertEquals(10, len(repos))
+        self.assertEquals(2, min(self._pages()))
+
+    def testStreaming(self):
+        gh = self._gh([1, 2], streaming=True)
+        self.assertEquals(20, len(list(gh.repos.iterForUser('verbal'))))
+
+class SingleFlightTest(BaseCase):
+
+    def testConcurrentShows(self):
+        """Identical concurrent GETs share one request and one parse."""
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+        def opener(url, data=None):
+            calls.append(url)
+            started.set()
+            release.wait(5)
+            return open('data/repo.xml')
+        repos = github.GitHub(fetcher=opener).repos
+        results = []
+        def show():
+            results.append(repos.show('schacon', 'grit'))
+        threads = [threading.Thread(target=show) for i in range(5)]
+        threads[0].start()
+        started.wait(5)
+        for t in threads[1:]:
+            t.start()
+        # Give the followers time to join the flight.
+        time.sleep(0.1)
+        release.set()
+        for t in threads:
+            t.join()
+        self.assertEquals(1, len(calls))
+        self.assertEquals(5, len(results))
+        self.assertTrue(all(r is results[0] for r in results))
+
+    def testInterrupted(self):
+        """A leader interrupted by KeyboardInterrupt frees the key."""
+        flights = workers.SingleFlight()
+        def interrupted():
+            raise KeyboardInterrupt()
+        self.assertRaises(KeyboardInterrupt, flights.do, 'k', interrupted)
+        self.assertEquals('ok', flights.do('k', lambda: 'ok'))
+
+    def testWritesNotCoalesced(self):
+        """Posts always go out."""
+        calls = []
+        def opener(url, data=None):
+            calls.append(url)
+            return StringIO.StringIO('')
+        gh = github.GitHub('dustin', 'p', fetcher=opener)
+        gh.repos.watch('dustin', 'py-github')
+        gh.repos.watch('dustin', 'py-github')
+        self.assertEquals(2, len(calls))
+
+    def testDisabled(self):
+        """Coalescing can be turned off."""
+        gh = github.GitHub(fetcher=lambda url, data=None: None,
+                           coalesce=False)
+        self.assertEquals(None, gh.repos.flights)
+
+    def testParsedIncrementally(self):
+        """Coalesced parsed calls still parse the body as it's read."""
+        reads = []
+        class Response(StringIO.StringIO):
+            def read(self, n=-1):
+                reads.append(n)
+                return StringIO.StringIO.read(self, n)
+        def opener(url, data=None):
+            return Response(open('data/commits.xml').read())
+        gh = github.GitHub(fetcher=opener)
+        self.assertEquals(30, len(gh.commits.forBranch('dustin', 'py-github')))
+        self.assertTrue(len(reads) > 2)
+        self.assertFalse(-1 in reads)
+
+class HedgingTest(unittest.TestCase):
+
+    def testSlowRequestHedged(self):
+        """A second request wins over a stalled one."""
+        calls = []
+        def opener(url, data=None):
+            calls.append(url)
+            if len(calls) == 1:
+                time.sleep(0.5)
+                return StringIO.StringIO('slow')
+            return StringIO.StringIO('fast')
+        f = hclient.HedgingFetcher(opener, delay=0.05)
+        self.assertEquals('fast', f('http://example.com/').read())
+        self.assertEquals(1, f.hedged)
+
+    def testFastRequestNotHedged(self):
+        """Quick answers don't cause duplicates."""
+        calls = []
+        def opener(url, data=None):
+            calls.append(url)
+            return StringIO.StringIO('fast')
+        f = hclient.HedgingFetcher(opener, delay=1)
+        self.assertEquals('fast', f('http://example.com/').read())
+        self.assertEquals(1, len(calls))
+
+    def testWritesNotHedged(self):
+        """Posts are sent once no matter how slow."""
+        calls = []
+        def opener(url, data=None):
+            calls.append(url)
+            time.sleep(0.1)
+            return StringIO.StringIO('')
+        hclient.HedgingFetcher(opener, delay=0.01)('http://example.com/', 'x=1')
+        self.assertEquals(1, len(calls))
+
+class DeadlineTest(BaseCase):
+
+    def testTimeoutsShrink(self):
+        """Sub-requests get the time remaining until the deadline."""
+        timeouts = []
+        def opener(url, data=None, timeout=None):
+            timeouts.append(timeout)
+            if '/collaborators' in url:
+                return StringIO.StringIO(AsyncTest.COLLABS % 'x')
+            return repoPages(url)
+        gh = github.GitHub('verbal', None, fetcher=opener)
+        self.assertEquals(10, len(gh.repos.collaborators_all(deadline=30)))
+        self.assertEquals(12, len(timeouts))
+        self.assertTrue(30 >= timeouts[0] >= timeouts[-1] > 0)
+
+    def testExceeded(self):
+        """Running out of time stops the operation."""
+        def opener(url, data=None, timeout=None):
+            time.sleep(0.05)
+            return open('data/repos.xml')
+        gh = github.GitHub('verbal', None, fetcher=opener)
+        self.assertRaises(github.DeadlineExceeded,
+                          gh.repos.addCollaborator_all, 'dustin', deadline=0.12)
+
+class CursorTest(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        os.unlink(self.path)
+        self.urls = []
+        self.dropped = 0
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _gh(self):
+        """Serves commits.xml as page 1, less its dropped newest commits."""
+        def opener(url, data=None):
+            self.urls.append(url)
+            if 'page=1' not in url:
+                return StringIO.StringIO('<commits type="array"/>')
+            doc = xml.dom.minidom.parse('data/commits.xml')
+            el = doc.documentElement
+            for c in el.getElementsByTagName('commit')[:self.dropped]:
+                el.removeChild(c)
+            return StringIO.StringIO(doc.toxml('utf-8'))
+        return github.GitHub(fetcher=opener)
+
+    def testSince(self):
+        gh = self._gh()
+        commits = gh.commits.forBranch('dustin', 'py-github')
+        self.urls = []
+        new = gh.commits.forBranchSince('dustin', 'py-github',
+                                        since=commits[3].id)
+        self.assertEquals([c.id for c in commits[:3]], [c.id for c in new])
+        self.assertEquals(1, len(self.urls))
+
+    def testSinceUnknown(self):
+        """A sha that's not on the branch gets the whole history."""
+        new = self._gh().commits.forBranchSince('dustin', 'py-github',
+                                                since='deadbeef')
+        self.assertEquals(30, len(new))
+        self.assertEquals(2, len(self.urls))
+
+    def testStore(self):
+        store = cursors.CursorStore(self.path)
+        self.assertEquals(None, store.get('dustin', 'py-github'))
+        store.set('dustin', 'py-github', 'master', 'abc')
+        store.set('dustin', 'py-github', 'other', 'def')
+        store = cursors.CursorStore(self.path)
+        self.assertEquals('abc', store.get('dustin', 'py-github'))
+        self.assertEquals('def', store.get('dustin', 'py-github', 'other'))
+        self.assertEquals(None, store.get('dustin', 'memcached'))
+
+    def testSync(self):
+        gh = self._gh()
+        self.dropped = 2
+        first = cursors.sync(gh, cursors.CursorStore(self.path),
+                             'dustin', 'py-github')
+        self.assertEquals(28, len(first))
+
+        self.dropped = 0
+        self.urls = []
+        store = cursors.CursorStore(self.path)
+        new = cursors.sync(gh, store, 'dustin', 'py-github')
+        self.assertEquals(2, len(new))
+        self.assertEquals(first[0].id, new[-1].parents[0].id)
+        self.assertEquals(new[0].id, store.get('dustin', 'py-github'))
+        self.assertEquals(1, len(self.urls))
+        self.assertEquals([], cursors.sync(gh, store, 'dustin', 'py-github'))
+
+class CassetteTest(BaseCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def _record(self):
+        def opener(url, data=None):
+            if '/missing' in url:
+                raise hclient.HTTPError(url, 404, 'Not Found', {},
+                                        StringIO.StringIO('nope'))
+            return open('data/repos.xml')
+        rec = cassette.RecordingFetcher(self.path, opener)
+        gh = github.GitHub('verbal', 'sekrit', fetcher=rec)
+        gh.repos.forUser('verbal')
+        self.assertRaises(hclient.HTTPError, gh.repos.show, 'verbal', 'missing')
+
+    def testReplay(self):
+        """Recorded responses are served back."""
+        self._record()
+        gh = github.GitHub('verbal', 'sekrit',
+                           fetcher=cassette.ReplayFetcher(self.path))
+        rs = gh.repos.forUser('verbal')
+        self.assertEquals(10, len(rs))
+        self.assertEquals('beanstalk-client-twisted', rs[0].name)
+        try:
+            gh.repos.show('verbal', 'missing')
+            self.fail("Expected an HTTPError")
+        except hclient.HTTPError, e:
+            self.assertEquals(404, e.code)
+            self.assertEquals('nope', e.read())
+        self.assertRaises(cassette.CassetteMiss, gh.repos.show, 'verbal', 'x')
+
+    def testTokensMasked(self):
+        """Tokens never reach the cassette."""
+        self._record()
+        self.assertEquals(-1, open(self.path).read().find('sekrit'))
+
+    def testSimulatedNetwork(self):
+        """Latency and bandwidth are simulated."""
+        self._record()
+        clock = FakeClock()
+        f = cassette.ReplayFetcher(self.path, latency=0.1, bandwidth=1000,
+                                   sleep=clock.sleep)
+        github.GitHub('verbal', 'sekrit', fetcher=f).repos.forUser('verbal')
+        size = os.path.getsize('data/repos.xml')
+        self.assertEquals([0.1 + size / 1000.0], clock.slept)
+
+class InstrumentationTest(BaseCase):
+
+    def testParsedEvent(self):
+        """Parsed calls report every phase to all sinks."""
+        gh = github.GitHub(fetcher=lambda url, data=None: open('data/repo.xml'))
+        events, others = [], []
+        gh.subscribe(events.append)
+        gh.subscribe(others.append)
+        gh.repos.show('schacon', 'grit')
+        self.assertEquals(events, others)
+        e = events[0]
+        self.assertEquals('RepositoryEndpoint.show', e['endpoint'])
+        self.assertEquals('https://github.com/api/v2/xml/repos/show/:user/:repo',
+                          e['template'])
+        self.assertEquals('GET', e['method'])
+        self.assertEquals(os.path.getsize('data/repo.xml'), e['bytes'])
+        self.assertEquals(set(['read', 'parse', 'total']), set(e['timings']))
+
+    def testDecoratedAndPaged(self):
+        """Templates cover query arguments and decorated methods."""
+        def opener(url, data=None):
+            if 'commits' in url:
+                return open('data/commits.xml')
+            return open('data/issues.list.xml')
+        gh = github.GitHub(fetcher=opener)
+        events = []
+        gh.subscribe(events.append)
+        gh.commits.forBranch('mojombo', 'grit', page=2)
+        gh.issues.list('schacon', 'simplegit')
+        self.assertEquals(['CommitEndpoint.forBranch', 'IssuesEndpoint.list'],
+                          [e['endpoint'] for e in events])
+        self.assertEquals('https://github.com/api/v2/xml/commits/list/'
+                          ':user/:repo/:branch?page=:page', events[0]['template'])
+
+    def testEqualArguments(self):
+        """Arguments with equal values each get their own name."""
+        def opener(url, data=None, **kwargs):
+            if 'v3' in url or 'api.github.com' in url:
+                return open('data/v3.commits.json')
+            return open('data/repo.xml')
+        events = []
+        gh = github.GitHub(fetcher=opener)
+        gh.subscribe(events.append)
+        gh.repos.show('dustin', 'dustin')
+        gh = github.GitHub(fetcher=opener, api='v3')
+        gh.subscribe(events.append)
+        gh.commits.forBranch('1', '1', '1', page=1)
+        self.assertEquals('https://github.com/api/v2/xml/repos/show/'
+                          ':user/:repo', events[0]['template'])
+        self.assertEquals('V3CommitEndpoint.forBranch', events[1]['endpoint'])
+        self.assertEquals('https://api.github.com/repos/:user/:repo/commits'
+                          '?page=:page&per_page=100&sha=:branch',
+                          events[1]['template'])
+
+    def testOtherThreads(self):
+        """Calls run on other threads are named too."""
+        gh = github.AsyncGitHub(fetcher=lambda url, data=None:
+                                open('data/repo.xml'))
+        events = []
+        gh.subscribe(events.append)
+        gh.repos.show('schacon', 'grit').result(5)
+        self.assertEquals('RepositoryEndpoint.show', events[0]['endpoint'])
+
+    def testPostAndErrors(self):
+        """Writes and failures are reported too."""
+        def opener(url, data=None):
+            if 'watch' in url:
+                return StringIO.StringIO('')
+            raise hclient.HTTPError(url, 404, 'Not Found', {},
+                                    StringIO.StringIO(''))
+        gh = github.GitHub('dustin', 'p', fetcher=opener)
+        events = []
+        gh.subscribe(events.append)
+        gh.repos.watch('dustin', 'py-github')
+        self.assertRaises(hclient.HTTPError, gh.users.show, 'nobody')
+        gh.unsubscribe(events.append)
+        gh.repos.watch('dustin', 'py-github')
+        self.assertEquals([('POST', 'RepositoryEndpoint.watch', None),
+                           ('GET', 'UserEndpoint.show', 404)],
+                          [(e['method'], e['endpoint'], e['status'])
+                           for e in events])
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, t):
+        self.slept.append(t)
+        self.now += t
+
+class HeaderResponse(StringIO.StringIO):
+
+    def __init__(self, body, headers):
+        StringIO.StringIO.__init__(self, body)
+        self.headers = headers
+
+    def info(self):
+        return self.headers
+
+class RateLimitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def _fetcher(self, opener, **kw):
+        return ratelimit.RateLimitedFetcher(opener, clock=self.clock,
+                                            sleep=self.clock.sleep, **kw)
+
+    def testBurstThenPace(self):
+        """A burst goes straight out, then requests are paced."""
+        f = self._fetcher(lambda url, data=None: StringIO.StringIO(''),
+                          rate=2.0, capacity=3)
+        for i in range(5):
+            f('http://example.com/')
+        self.assertEquals([0.5, 0.5], self.clock.slept)
+
+    def testCredentialsHaveSeparateBuckets(self):
+        """Each login gets its own budget."""
+        f = self._fetcher(lambda url, data=None: StringIO.StringIO(''),
+                          rate=1.0, capacity=1)
+        f('http://example.com/?login=a&token=x')
+        f('http://example.com/?login=b&token=x')
+        self.assertEquals([], self.clock.slept)
+        f('http://example.com/?login=a&token=x')
+        self.assertEquals([1.0], self.clock.slept)
+
+    def testHeaderFeedback(self):
+        """Rate limit headers are exposed and set the pace."""
+        h = {'x-ratelimit-remaining': '10', 'x-ratelimit-limit': '5000',
+             'x-ratelimit-reset': '1020'}
+        f = self._fetcher(lambda url, data=None: HeaderResponse('', h))
+        self.assertEquals(None, f.remaining())
+        f('http://example.com/')
+        self.assertEquals(10, f.remaining())
+        self.assertEquals(5000, f.bucket().limit)
+        self.assertAlmostEquals(0.5, f.bucket().rate)
+
+    def testRetryAfterReset(self):
+        """A request refused for the limit is retried once it resets."""
+        calls = []
+        def opener(url, data=None):
+            calls.append(url)
+            if len(calls) == 1:
+                raise hclient.HTTPError(url, 403, 'Forbidden',
+                                        {'x-ratelimit-remaining': '0',
+                                         'x-ratelimit-reset': '1030'},
+                                        StringIO.StringIO(''))
+            return StringIO.StringIO('ok')
+        f = self._fetcher(opener)
+        self.assertEquals('ok', f('http://example.com/').read())
+        self.assertEquals(2, len(calls))
+        self.assertEquals(1030, self.clock.now)
+
+    def testRetryWithoutReset(self):
+        """Without a reset time, a refused request backs off."""
+        calls = []
+        def opener(url, data=None):
+            calls.append(url)
+            if len(calls) == 1:
+                raise hclient.HTTPError(url, 403, 'Forbidden',
+                                        {'x-ratelimit-remaining': '0'},
+                                        StringIO.StringIO(''))
+            return StringIO.StringIO('ok')
+        f = self._fetcher(opener, backoff=45)
+        self.assertEquals('ok', f('http://example.com/').read())
+        self.assertEquals(2, len(calls))
+        self.assertTrue(1045 <= self.clock.now)
+
+    def testDefaultsStayUnderLimit(self):
+        """The defaults allow no more than 60 requests in a minute."""
+        f = self._fetcher(lambda url, data=None: StringIO.StringIO(''))
+        sent = []
+        while self.clock.now < 1060:
+            f('http://example.com/')
+            sent.append(self.clock.now)
+        self.assertEquals(60, len([t for t in sent if t < 1060]))
+
+class LocalHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serve canned bodies over keep-alive connections."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        self.server.requests.append(self.path)
+        if self.path == '/slow':
+            time.sleep(0.5)
+        body = self.server.bodies.get(self.path, '')
+        if self.headers.get('if-none-match') == self.server.etag:
+            self.send_response(304)
+            body = ''
+        else:
+            self.send_response(self.path in self.server.bodies and 200 or 404)
+        accepted = self.headers.get('accept-encoding', '')
+        if body and self.server.encoding and self.server.encoding in accepted:
+            body = self.server.encoders[self.server.encoding](body)
+            self.send_header('Content-Encoding', self.server.encoding)
+        self.send_header('ETag', self.server.etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class LocalServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+class LocalServerCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalServer(('127.0.0.1', 0), LocalHandler)
+        self.server.connections = set()
+        self.server.requests = []
+        self.server.etag = '"v1"'
+        self.server.encoding = None
+        self.server.encoders = {'gzip': self._gzip, 'deflate': zlib.compress}
+        self.server.bodies = {'/a': 'hello', '/b': 'world'}
+        t = threading.Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+        self.base = 'http://127.0.0.1:%d' % self.server.server_port
+        self.pool = hclient.ConnectionPool(maxPerHost=2)
+
+    def _gzip(self, body):
+        s = StringIO.StringIO()
+        g = gzip.GzipFile(fileobj=s, mode='w')
+        g.write(body)
+        g.close()
+        return s.getvalue()
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+class ConnectionPoolTest(LocalServerCase):
+
+    def testKeepAlive(self):
+        """Sequential requests reuse one connection."""
+        for p in ['/a', '/b', '/a']:
+            self.pool.fetch(self.base + p).read()
+        self.assertEquals(1, len(self.server.connections))
+
+    def testConcurrentRequests(self):
+        """Unread responses hold their connection; the cap is respected."""
+        r1 = self.pool.fetch(self.base + '/a')
+        r2 = self.pool.fetch(self.base + '/b')
+        self.assertEquals(2, len(self.server.connections))
+        self.assertEquals('hello', r1.read())
+        self.assertEquals('world', r2.read())
+        self.assertEquals('hello', self.pool.fetch(self.base + '/a').read())
+        self.assertEquals(2, len(self.server.connections))
+
+    def testDroppedResponses(self):
+        """Responses dropped unread give their connection back."""
+        for i in range(3):
+            self.pool.fetch(self.base + '/a')
+            self.pool.fetch(self.base + '/b')
+        self.assertEquals('hello', self.pool.fetch(self.base + '/a',
+                                                   timeout=1).read())
+
+    def testFailedRead(self):
+        """A read that fails gives its connection back."""
+        held = self.pool.fetch(self.base + '/a')
+        r = self.pool.fetch(self.base + '/b')
+        def broken(*args):
+            raise socket.timeout()
+        r._resp.read = broken
+        self.assertRaises(socket.timeout, r.read)
+        self.assertEquals('hello', self.pool.fetch(self.base + '/a',
+                                                   timeout=1).read())
+        held.close()
+
+    def testWaitTimeout(self):
+        """Waiting for a connection is bounded by the timeout."""
+        held = [self.pool.fetch(self.base + p) for p in ['/a', '/b']]
+        start = time.time()
+        self.assertRaises(socket.timeout, self.pool.fetch, self.base + '/a',
+                          timeout=0.1)
+        self.assertTrue(time.time() - start < 1)
+        self.assertEquals(['hello', 'world'], [r.read() for r in held])
+
+    def testGrow(self):
+        """Growing the pool lets waiting requests through."""
+        held = [self.pool.fetch(self.base + p) for p in ['/a', '/b']]
+        rv = []
+        t = threading.Thread(
+            target=lambda: rv.append(self.pool.fetch(self.base + '/a',
+                                                     timeout=5).read()))
+        t.start()
+        time.sleep(0.05)
+        self.assertEquals([], rv)
+        self.pool.grow(3)
+        t.join()
+        self.assertEquals(['hello'], rv)
+        self.assertEquals(3, len(self.server.connections))
+        self.pool.grow(1)
+        self.assertEquals(3, self.pool.maxPerHost)
+        self.assertEquals(['hello', 'world'], [r.read() for r in held])
+
+    def testProxy(self):
+        """Requests go through a configured proxy."""
+        self.server.bodies['http://example.invalid/a'] = 'proxied'
+        saved = dict(os.environ)
+        try:
+            for k in ['no_proxy', 'NO_PROXY', 'HTTP_PROXY']:
+                os.environ.pop(k, None)
+            os.environ['http_proxy'] = self.base
+            r = self.pool.fetch('http://example.invalid/a')
+            self.assertEquals('proxied', r.read())
+        finally:
+            os.environ.clear()
+            os.environ.update(saved)
+        self.assertEquals(['http://example.invalid/a'], self.server.requests)
+
+    def testRetries(self):
+        """Only idempotent requests are retried on a fresh connection."""
+        attempts = []
+        class Broken(object):
+            sock = socket.socket()
+            def request(self, *args):
+                raise socket.error("connection reset")
+            def close(self):
+                pass
+        def acquire(key, timeout=None):
+            attempts.append(key)
+            return Broken(), len(attempts) == 1
+        self.pool._acquire = acquire
+        self.pool._release = lambda key, conn, reusable: None
+        self.assertRaises(socket.error, self.pool.fetch, self.base + '/a',
+                          data='x=1')
+        self.assertEquals(1, len(attempts))
+        del attempts[:]
+        self.assertRaises(socket.error, self.pool.fetch, self.base + '/a')
+        self.assertEquals(2, len(attempts))
+        Broken.sock.close()
+
+    def testIdleEviction(self):
+        """Connections idle past the timeout are not reused."""
+        self.pool.idleTimeout = -1
+        self.pool.fetch(self.base + '/a').read()
+        self.pool.fetch(self.base + '/a').read()
+        self.assertEquals(2, len(self.server.connections))
+
+    def testHTTPError(self):
+        """Error statuses raise like urlopen."""
+        try:
+            self.pool.fetch(self.base + '/missing')
+            self.fail("Expected an HTTPError")
+        except hclient.HTTPError, e:
+            self.assertEquals(404, e.code)
+
+class TimeoutTest(LocalServerCase):
+
+    def testReadTimeout(self):
+        """A stalled server times out."""
+        self.pool.readTimeout = 0.1
+        self.assertRaises(socket.timeout, self.pool.fetch, self.base + '/slow')
+
+    def testPerCallTimeout(self):
+        """A timeout can be given for a single request."""
+        self.assertRaises(socket.timeout, self.pool.fetch, self.base + '/slow',
+                          timeout=0.1)
+        self.assertEquals('hello', self.pool.fetch(self.base + '/a',
+                                                   timeout=0.1).read())
+
+class CompressionTest(LocalServerCase):
+
+    def setUp(self):
+        LocalServerCase.setUp(self)
+        self.body = open('data/commits.xml').read()
+        self.server.bodies['/c'] = self.body
+
+    def testGzip(self):
+        """gzip bodies are decompressed."""
+        self.server.encoding = 'gzip'
+        r = self.pool.fetch(self.base + '/c')
+        self.assertEquals('gzip', r.info().get('content-encoding'))
+        self.assertEquals(self.body, r.read())
+
+    def testDeflateIncremental(self):
+        """Compressed bodies can be read a piece at a time."""
+        self.server.encoding = 'deflate'
+        r = self.pool.fetch(self.base + '/c')
+        chunks = []
+        while True:
+            chunk = r.read(1000)
+            if not chunk:
+                break
+            self.assertTrue(len(chunk) <= 1000)
+            chunks.append(chunk)
+        self.assertEquals(self.body, ''.join(chunks))
+        # The connection went back to the pool.
+        self.pool.fetch(self.base + '/c').read()
+        self.assertEquals(1, len(self.server.connections))
+
+    def testRawDeflate(self):
+        """deflate without a zlib header is understood too."""
+        self.server.encoding = 'deflate'
+        self.server.encoders['deflate'] = lambda b: zlib.compress(b)[2:-4]
+        self.assertEquals(self.body, self.pool.fetch(self.base + '/c').read())
+
+class CachingFetcherTest(LocalServerCase):
+
+    def testRevalidation(self):
+        """An unchanged resource is served from the cache."""
+        f = hclient.CachingFetcher(self.pool.fetch)
+        r = f(self.base + '/a')
+        self.assertEquals('miss', r.cache)
+        self.assertEquals('hello', r.read())
+        r = f(self.base + '/a')
+        self.assertEquals('hit', r.cache)
+        self.assertEquals('hello', r.read())
+        self.assertEquals(2, len(self.server.requests))
+        self.assertEquals((1, 1), (f.hits, f.misses))
+
+    def testChanged(self):
+        """A changed resource replaces the cached body."""
+        f = hclient.CachingFetcher(self.pool.fetch)
+        f(self.base + '/a').read()
+        self.server.etag = '"v2"'
+        self.server.bodies['/a'] = 'changed'
+        r = f(self.base + '/a')
+        self.assertEquals('miss', r.cache)
+        self.assertEquals('changed', r.read())
+
+    def testNotModifiedHeaders(self):
+        """A 304's own headers and timings come through."""
+        replies = [(200, {'etag': '"v1"', 'content-type': 'text/xml',
+                          'x-ratelimit-remaining': '4999'}),
+                   (304, {'etag': '"v1"', 'x-ratelimit-remaining': '3'})]
+        def opener(url, data=None, **kwargs):
+            code, h = replies.pop(0)
+            r = HeaderResponse(code == 200 and 'hello' or '', h)
+            r.code = code
+            r.timings = {'first_byte': code / 1000.0}
+            return r
+        f = ratelimit.RateLimitedFetcher(hclient.CachingFetcher(opener))
+        f('http://example.com/').read()
+        r = f('http://example.com/')
+        self.assertEquals('hit', r.cache)
+        self.assertEquals('hello', r.read())
+        self.assertEquals(3, f.remaining())
+        self.assertEquals('text/xml', r.info().get('content-type'))
+        self.assertEquals({'first_byte': 0.304}, r.timings)
+
+    def testEviction(self):
+        """Only maxEntries bodies are kept."""
+        f = hclient.CachingFetcher(self.pool.fetch, maxEntries=1)
+        f(self.base + '/a').read()
+        f(self.base + '/b').read()
+        self.assertEquals('miss', f(self.base + '/a').cache)
 
 if __name__ == '__main__':
     unittest.main()
@@ -26,15 +26,26 @@ Yet another HTTP client abstraction.
 """
 
 import sys
+import time
+import zlib
+import socket
+import threading
+from collections import OrderedDict
 PY3 = sys.version_info[0] == 3
 
 if PY3:
     from urllib.parse import urlencode
     from urllib.parse import quote
     from urllib.parse import quote_plus
-    from urllib.request import Request
-    from urllib.request import urlopen
+    from urllib.parse import unquote
+    from urllib.parse import urlsplit
+    from urllib.parse import urljoin
+    from urllib.request import Request, urlopen, getproxies, proxy_bypass
+    from urllib.error import HTTPError
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException
+    from io import BytesIO as StringIO
     import base64
+    import queue as Queue
 
     def b64encode(s):
         return str(base64.b64encode(bytes(s, 'utf8')), 'utf8')
@@ -43,17 +54,530 @@ else:
     from urllib import urlencode
     from urllib import quote
     from urllib import quote_plus
-    from urllib2 import Request, urlopen
+    from urllib import unquote
+    from urlparse import urlsplit, urljoin
+    from urllib import getproxies, proxy_bypass
+    from urllib2 import Request, urlopen, HTTPError
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException
+    from StringIO import StringIO
 
     from base64 import b64encode
+    import Queue
 
-def fetch(url, data=None, username=None, password=None, headers={},
-          method=None):
+USER_AGENT = 'py-github'
+
+ACCEPT_ENCODING = 'gzip, deflate'
+
+_CHUNK_SIZE = 16384
+
+_REDIRECTS = (301, 302, 303, 307)
+_MAX_REDIRECTS = 5
+
+# Methods that can safely be sent again after a connection failure.
+_IDEMPOTENT = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+def _proxied(url):
+    """Whether a proxy is configured for url."""
+    u = urlsplit(url)
+    return u.scheme in getproxies() and not proxy_bypass(u.hostname)
+
+def _urlopen(url, data, headers, method, timeout):
+    """Perform a request with urlopen, which knows about proxies."""
     request = Request(url, data=data, headers=headers)
     if method:
         request.get_method = lambda: method
-    if username and password:
-        request.add_header('Authorization',
-                           'Basic ' + b64encode("%s:%s" % (username,
-                                                           password)).strip())
-    return urlopen(request)
+    if timeout is None:
+        return urlopen(request)
+    return urlopen(request, timeout=timeout)
+
+def _shortest(*timeouts):
+    timeouts = [t for t in timeouts if t is not None]
+    return timeouts and min(timeouts) or None
+
+class PooledResponse(object):
+    """A response whose connection goes back to its pool once the body is read.
+
+    Behaves like the object returned by urlopen.  gzip and deflate
+    bodies are decompressed a chunk at a time as they're read.
+
+    timings holds the seconds spent waiting for a pooled connection
+    (queue), connecting, including name resolution (connect), and from
+    sending the request to receiving the response headers (first_byte)."""
+
+    timings = {}
+
+    def __init__(self, url, resp, pool, key, conn):
+        self.url = url
+        self.code = self.status = resp.status
+        self.msg = resp.reason
+        self.headers = resp.msg
+        self._resp = resp
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._buf = b''
+        self._eof = False
+        # Some servers send deflate without the zlib header.
+        self._fallback = False
+        encoding = (resp.getheader('content-encoding') or '').lower()
+        if encoding == 'gzip':
+            self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            self._decoder = zlib.decompressobj()
+            self._fallback = True
+        else:
+            self._decoder = None
+
+    def _release(self):
+        if self._conn:
+            self._pool._release(self._key, self._conn,
+                                not self._resp.will_close)
+            self._conn = None
+
+    def _readRaw(self, amt=None):
+        if amt is None:
+            data = self._resp.read()
+        else:
+            data = self._resp.read(amt)
+        if self._resp.isclosed():
+            self._release()
+        if not data:
+            self._eof = True
+        return data
+
+    def _decode(self, data):
+        if not data:
+            return self._decoder.flush()
+        try:
+            return self._decoder.decompress(data)
+        except zlib.error:
+            if not self._fallback:
+                raise
+            self._fallback = False
+            self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self._decoder.decompress(data)
+
+    def read(self, amt=None):
+        try:
+            return self._read(amt)
+        except Exception:
+            # Whatever's left of the body is unusable, and so is the
+            # connection.
+            self.close()
+            raise
+
+    def _read(self, amt):
+        if not self._decoder:
+            return self._readRaw(amt)
+        if amt is None:
+            chunks = [self._buf]
+            while not self._eof:
+                chunks.append(self._decode(self._readRaw(_CHUNK_SIZE)))
+            self._buf = b''
+            return b''.join(chunks)
+        while len(self._buf) < amt and not self._eof:
+            self._buf += self._decode(self._readRaw(_CHUNK_SIZE))
+        data, self._buf = self._buf[:amt], self._buf[amt:]
+        return data
+
+    def close(self):
+        if self._conn:
+            # The body wasn't consumed, so the connection can't be reused.
+            conn, self._conn = self._conn, None
+            conn.close()
+            self._pool._release(self._key, conn, False)
+        self._resp.close()
+
+    def __del__(self):
+        # Responses dropped before being read or closed still give their
+        # connection back.
+        if self._conn:
+            self.close()
+
+    def info(self):
+        return self.headers
+
+    def getcode(self):
+        return self.code
+
+    def geturl(self):
+        return self.url
+
+class ConnectionPool(object):
+    """A thread-safe pool of persistent HTTP connections.
+
+    At most maxPerHost connections are open to any one host at a time;
+    callers wanting another one wait for a connection to come back.
+    Idle connections are closed after idleTimeout seconds.
+
+    connectTimeout and readTimeout (in seconds, None to wait forever)
+    bound establishing a connection and each wait for data."""
+
+    def __init__(self, maxPerHost=4, idleTimeout=60, connectTimeout=None,
+                 readTimeout=None):
+        self.maxPerHost = maxPerHost
+        self.idleTimeout = idleTimeout
+        self.connectTimeout = connectTimeout
+        self.readTimeout = readTimeout
+        self._cond = threading.Condition()
+        self._idle = {}
+        self._open = {}
+
+    def grow(self, maxPerHost):
+        """Allow at least maxPerHost connections to each host."""
+        self._cond.acquire()
+        try:
+            if maxPerHost > self.maxPerHost:
+                self.maxPerHost = maxPerHost
+                self._cond.notify_all()
+        finally:
+            self._cond.release()
+
+    def _evict(self, now):
+        for key, idle in list(self._idle.items()):
+            while idle and now - idle[0][1] > self.idleTimeout:
+                conn, used = idle.pop(0)
+                conn.close()
+                self._open[key] -= 1
+
+    def _acquire(self, key, timeout=None):
+        """Get a (connection, reused) pair for the given host key.
+
+        Raises socket.timeout if none is free within timeout seconds."""
+        deadline = timeout is not None and time.time() + timeout or None
+        self._cond.acquire()
+        try:
+            while True:
+                self._evict(time.time())
+                idle = self._idle.get(key)
+                if idle:
+                    return idle.pop()[0], True
+                if self._open.get(key, 0) < self.maxPerHost:
+                    self._open[key] = self._open.get(key, 0) + 1
+                    break
+                if deadline is None:
+                    self._cond.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise socket.timeout("No connection free for %s:%s"
+                                         % key[1:])
+                self._cond.wait(remaining)
+        finally:
+            self._cond.release()
+
+        scheme, host, port = key
+        if scheme == 'https':
+            return HTTPSConnection(host, port), False
+        return HTTPConnection(host, port), False
+
+    def _release(self, key, conn, reusable):
+        self._cond.acquire()
+        try:
+            if reusable:
+                self._idle.setdefault(key, []).append((conn, time.time()))
+            else:
+                conn.close()
+                self._open[key] -= 1
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def close(self):
+        """Close all idle connections."""
+        self._cond.acquire()
+        try:
+            for key, idle in self._idle.items():
+                for conn, used in idle:
+                    conn.close()
+                    self._open[key] -= 1
+            self._idle.clear()
+            self._cond.notify_all()
+        finally:
+            self._cond.release()
+
+    def _request(self, method, url, body, headers, timeout=None):
+        u = urlsplit(url)
+        key = (u.scheme, u.hostname,
+               u.port or {'https': 443}.get(u.scheme, 80))
+        path = u.path or '/'
+        if u.query:
+            path += '?' + u.query
+
+        connectTimeout = _shortest(self.connectTimeout, timeout)
+        readTimeout = _shortest(self.readTimeout, timeout)
+
+        while True:
+            start = time.time()
+            conn, reused = self._acquire(key, timeout)
+            timings = {'queue': time.time() - start, 'connect': 0.0}
+            try:
+                if conn.sock is None:
+                    if connectTimeout is not None:
+                        conn.timeout = connectTimeout
+                    start = time.time()
+                    conn.connect()
+                    timings['connect'] = time.time() - start
+                conn.sock.settimeout(readTimeout)
+                start = time.time()
+                conn.request(method, path, body, headers)
+                resp = conn.getresponse()
+                timings['first_byte'] = time.time() - start
+            except socket.timeout:
+                conn.close()
+                self._release(key, conn, False)
+                raise
+            except (socket.error, HTTPException):
+                conn.close()
+                self._release(key, conn, False)
+                if reused and method in _IDEMPOTENT:
+                    # The server may have dropped an idle keep-alive
+                    # connection; try again on a fresh one.  Others
+                    # might have been acted on already.
+                    continue
+                raise
+            rv = PooledResponse(url, resp, self, key, conn)
+            rv.timings = timings
+            return rv
+
+    def fetch(self, url, data=None, username=None, password=None, headers={},
+              method=None, timeout=None):
+        """Perform a request, returning a file-like response.
+
+        timeout (in seconds) bounds connecting and each read, on top of
+        the pool's own timeouts.  Raises HTTPError for error responses
+        like urlopen does.  Requests that should go through a proxy (per
+        the http_proxy and https_proxy environment variables) are made
+        with urlopen instead of a pooled connection."""
+        h = {'User-Agent': USER_AGENT}
+        h.update(headers)
+        if data is not None:
+            h.setdefault('Content-Type', 'application/x-www-form-urlencoded')
+        if username and password:
+            h['Authorization'] = 'Basic ' + b64encode(
+                "%s:%s" % (username, password)).strip()
+        if _proxied(url):
+            return _urlopen(url, data, h, method, timeout)
+        h.setdefault('Accept-Encoding', ACCEPT_ENCODING)
+        if not method:
+            method = data is None and 'GET' or 'POST'
+
+        for i in range(_MAX_REDIRECTS + 1):
+            rv = self._request(method, url, data, h, timeout)
+            if rv.code in _REDIRECTS and method in ('GET', 'HEAD'):
+                rv.read()
+                url = urljoin(url, rv.headers.get('location'))
+                continue
+            break
+
+        if rv.code >= 400 or rv.code in _REDIRECTS:
+            body = rv.read()
+            raise HTTPError(url, rv.code, rv.msg, rv.headers, StringIO(body))
+        return rv
+
+_pool = ConnectionPool()
+
+def allowConnections(n):
+    """Let fetch open at least n connections to each host at once.
+
+    fetch shares one pool opening 4 by default, which would otherwise
+    cap any concurrency asked of github calls using it."""
+    _pool.grow(n)
+
+def fetch(url, data=None, username=None, password=None, headers={},
+          method=None, timeout=None):
+    return _pool.fetch(url, data, username, password, headers, method,
+                       timeout)
+
+class BufferedResponse(object):
+    """A response whose body is already in memory.
+
+    When served by CachingFetcher, cache is 'hit' if the body came from
+    the cache and 'miss' otherwise."""
+
+    def __init__(self, url, body, headers, code=200, cache=None, timings={}):
+        self.url = url
+        self.timings = timings
+        self.code = self.status = code
+        self.headers = headers
+        self.cache = cache
+        self.body = body
+        self._fp = StringIO(body)
+
+    def read(self, amt=None):
+        if amt is None:
+            return self._fp.read()
+        return self._fp.read(amt)
+
+    def close(self):
+        self._fp.close()
+
+    def info(self):
+        return self.headers
+
+    def getcode(self):
+        return self.code
+
+    def geturl(self):
+        return self.url
+
+def buffered(resp, url=None):
+    """Read a response fully into a BufferedResponse."""
+    info = getattr(resp, 'info', None)
+    return BufferedResponse(url or getattr(resp, 'url', None), resp.read(),
+                            info and info() or {},
+                            getattr(resp, 'code', 200),
+                            getattr(resp, 'cache', None),
+                            getattr(resp, 'timings', {}))
+
+class CachingFetcher(object):
+    """A fetcher that revalidates GETs using ETag and Last-Modified.
+
+    Bodies are remembered per URL and credentials.  Later GETs for the
+    same resource send If-None-Match/If-Modified-Since, and a 304 reply
+    is answered from the cache.  At most maxEntries bodies are kept,
+    dropping the least recently used first.
+
+    The wrapped fetcher must accept a headers keyword argument."""
+
+    def __init__(self, fetcher=fetch, maxEntries=1000):
+        self.fetcher = fetcher
+        self.maxEntries = maxEntries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, key):
+        self._lock.acquire()
+        try:
+            entry = self._entries.pop(key, None)
+            if entry:
+                self._entries[key] = entry
+            return entry
+        finally:
+            self._lock.release()
+
+    def _store(self, key, entry):
+        self._lock.acquire()
+        try:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.maxEntries:
+                self._entries.popitem(False)
+        finally:
+            self._lock.release()
+
+    def __call__(self, url, data=None, username=None, password=None,
+                 headers={}, method=None, **kwargs):
+        if data is not None or method not in (None, 'GET'):
+            return self.fetcher(url, data, username=username,
+                                password=password, headers=headers,
+                                method=method, **kwargs)
+
+        key = (url, username, password)
+        entry = self._lookup(key)
+        h = dict(headers)
+        if entry:
+            etag, modified, body, hdrs = entry
+            if etag:
+                h['If-None-Match'] = etag
+            if modified:
+                h['If-Modified-Since'] = modified
+
+        try:
+            resp = self.fetcher(url, username=username, password=password,
+                                headers=h, **kwargs)
+        except HTTPError as e:
+            if e.code != 304 or not entry:
+                raise
+            resp = e
+
+        timings = getattr(resp, 'timings', {})
+        if entry and resp.code == 304:
+            resp.read()
+            self.hits += 1
+            # The 304's headers (rate limits, dates, a new ETag) are
+            # current; the stored ones fill in the rest.
+            hdrs = dict((k.lower(), v) for k, v in entry[3].items())
+            hdrs.update((k.lower(), v) for k, v in (resp.info() or {}).items())
+            self._store(key, (hdrs.get('etag', entry[0]),
+                              hdrs.get('last-modified', entry[1]),
+                              entry[2], hdrs))
+            return BufferedResponse(url, entry[2], hdrs, cache='hit',
+                                    timings=timings)
+
+        self.misses += 1
+        body = resp.read()
+        hdrs = resp.info()
+        etag = hdrs.get('etag')
+        modified = hdrs.get('last-modified')
+        if etag or modified:
+            self._store(key, (etag, modified, body, hdrs))
+        return BufferedResponse(url, body, hdrs, resp.code, 'miss', timings)
+
+    def clear(self):
+        """Forget everything cached."""
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+        finally:
+            self._lock.release()
+
+class HedgingFetcher(object):
+    """A fetcher that races a second copy of slow GETs.
+
+    If a GET hasn't answered within delay seconds the same request is
+    sent again, and whichever answers first is used; the other response
+    is closed when it arrives.  Other methods are passed straight
+    through since they may not be safe to repeat."""
+
+    def __init__(self, fetcher=fetch, delay=1.0):
+        self.fetcher = fetcher
+        self.delay = delay
+        self.hedged = 0
+
+    def _attempt(self, results, url, kwargs):
+        try:
+            results.put((True, self.fetcher(url, **kwargs)))
+        except Exception as e:
+            results.put((False, e))
+
+    def _start(self, results, url, kwargs):
+        t = threading.Thread(target=self._attempt, args=(results, url, kwargs))
+        t.daemon = True
+        t.start()
+
+    def _discard(self, results, pending):
+        for i in range(pending):
+            ok, v = results.get()
+            if ok and hasattr(v, 'close'):
+                v.close()
+
+    def __call__(self, url, data=None, **kwargs):
+        if data is not None or kwargs.get('method') not in (None, 'GET'):
+            return self.fetcher(url, data, **kwargs)
+
+        results = Queue.Queue()
+        self._start(results, url, kwargs)
+        pending = 1
+        try:
+            ok, v = results.get(timeout=self.delay)
+        except Queue.Empty:
+            self.hedged += 1
+            self._start(results, url, kwargs)
+            pending += 1
+            ok, v = results.get()
+        pending -= 1
+
+        while not ok and pending:
+            ok, v = results.get()
+            pending -= 1
+        if pending:
+            t = threading.Thread(target=self._discard, args=(results, pending))
+            t.daemon = True
+            t.start()
+
+        if not ok:
+            raise v
+        return v
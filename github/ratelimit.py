@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2005-2008  Dustin Sallings <dustin@spy.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# <http://www.opensource.org/licenses/mit-license.php>
+"""
+Client-side pacing of requests against github's rate limit.
+"""
+
+import time
+import threading
+
+import hclient
+
+class TokenBucket(object):
+    """A token bucket refilling at rate tokens per second up to capacity.
+
+    The server's view of the budget (from the X-RateLimit headers) is
+    folded in as responses arrive: remaining, limit and reset reflect
+    the last values seen."""
+
+    def __init__(self, rate, capacity, clock=time.time, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.remaining = None
+        self.limit = None
+        self.reset = None
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """Take a token, waiting until one is available."""
+        while True:
+            self._lock.acquire()
+            try:
+                now = self._clock()
+                self._refill(now)
+                # Allow for rounding, which can leave the bucket a hair
+                # short of a token after waiting exactly long enough.
+                if self.tokens >= 1 - 1e-9:
+                    self.tokens = max(self.tokens - 1, 0.0)
+                    return
+                wait = (1 - self.tokens) / self.rate
+            finally:
+                self._lock.release()
+            self._sleep(wait)
+
+    def update(self, remaining, limit=None, reset=None):
+        """Adjust the bucket to what the server says is left.
+
+        When the reset time is known, the refill rate becomes whatever
+        spreads the remaining budget evenly until then."""
+        self._lock.acquire()
+        try:
+            now = self._clock()
+            self._refill(now)
+            self.remaining = remaining
+            if limit is not None:
+                self.limit = limit
+            if reset is not None:
+                self.reset = reset
+            self.tokens = min(self.tokens, remaining)
+            if reset is not None and reset > now:
+                self.rate = max(remaining, 1) / float(reset - now)
+        finally:
+            self._lock.release()
+
+def _header(resp, name):
+    info = getattr(resp, 'info', None)
+    v = info and info().get(name)
+    if v is not None:
+        try:
+            return int(v)
+        except ValueError:
+            pass
+    return None
+
+class RateLimitedFetcher(object):
+    """A fetcher that paces requests with a token bucket per credential.
+
+    Each credential may make a burst of capacity requests and then rate
+    per second.  No minute then sees more than capacity + 60 * rate
+    requests, which by default is github's v2 allowance of 60.  Rate
+    limit headers on responses tighten or loosen the pace.  A request
+    refused for being over the limit is retried once the limit resets,
+    or after backoff seconds if github didn't say when that is."""
+
+    def __init__(self, fetcher=hclient.fetch, rate=50 / 60.0, capacity=10,
+                 clock=time.time, sleep=time.sleep, backoff=60):
+        self.fetcher = fetcher
+        self.rate = rate
+        self.capacity = capacity
+        self.backoff = backoff
+        self._clock = clock
+        self._sleep = sleep
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, user=None):
+        """The TokenBucket for the given login (None for anonymous)."""
+        self._lock.acquire()
+        try:
+            b = self._buckets.get(user)
+            if b is None:
+                b = TokenBucket(self.rate, self.capacity,
+                                self._clock, self._sleep)
+                self._buckets[user] = b
+            return b
+        finally:
+            self._lock.release()
+
+    def remaining(self, user=None):
+        """Requests left for the given login, as last reported by github.
+
+        None when no response has reported it yet."""
+        return self.bucket(user).remaining
+
+    def _credential(self, url, username):
+        if username:
+            return username
+        for param in hclient.urlsplit(url).query.split('&'):
+            if param.startswith('login='):
+                return hclient.unquote(param[6:])
+        return None
+
+    def _observe(self, b, resp):
+        remaining = _header(resp, 'x-ratelimit-remaining')
+        if remaining is not None:
+            b.update(remaining, _header(resp, 'x-ratelimit-limit'),
+                     _header(resp, 'x-ratelimit-reset'))
+        return remaining
+
+    def __call__(self, url, data=None, **kwargs):
+        b = self.bucket(self._credential(url, kwargs.get('username')))
+        b.acquire()
+        try:
+            resp = self.fetcher(url, data, **kwargs)
+        except hclient.HTTPError as e:
+            if e.code != 403 or self._observe(b, e) != 0:
+                raise
+            if b.reset:
+                self._sleep(max(b.reset - self._clock(), 0))
+            else:
+                self._sleep(self.backoff)
+            b.acquire()
+            resp = self.fetcher(url, data, **kwargs)
+        self._observe(b, resp)
+        return resp
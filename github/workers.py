@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2005-2008  Dustin Sallings <dustin@spy.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# <http://www.opensource.org/licenses/mit-license.php>
+"""
+Futures and a bounded thread pool for running github calls concurrently.
+"""
+
+import sys
+import threading
+import Queue
+
+class CancelledError(Exception):
+    """Raised when asking for the result of a cancelled Future."""
+
+class Future(object):
+    """The eventual result of a call."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._state = 'pending'
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def done(self):
+        return self._state in ('finished', 'cancelled')
+
+    def cancelled(self):
+        return self._state == 'cancelled'
+
+    def cancel(self):
+        """Cancel the call if it hasn't started yet."""
+        self._cond.acquire()
+        try:
+            if self._state != 'pending':
+                return self._state == 'cancelled'
+            self._state = 'cancelled'
+            self._cond.notify_all()
+        finally:
+            self._cond.release()
+        self._runCallbacks()
+        return True
+
+    def start(self):
+        """Mark the call as running; False if it was cancelled first."""
+        self._cond.acquire()
+        try:
+            if self._state != 'pending':
+                return False
+            self._state = 'running'
+            return True
+        finally:
+            self._cond.release()
+
+    def _finish(self, result, exc_info):
+        self._cond.acquire()
+        try:
+            if self.done():
+                return
+            self._result = result
+            self._exc_info = exc_info
+            self._state = 'finished'
+            self._cond.notify_all()
+        finally:
+            self._cond.release()
+        self._runCallbacks()
+
+    def set_result(self, result):
+        self._finish(result, None)
+
+    def set_exception(self, exc_info=None):
+        """Fail the call with the given (or the current) exception info."""
+        self._finish(None, exc_info or sys.exc_info())
+
+    def _runCallbacks(self):
+        callbacks, self._callbacks = self._callbacks, []
+        for cb in callbacks:
+            cb(self)
+
+    def add_done_callback(self, fn):
+        """Call fn(future) once done, right away if it already is."""
+        self._cond.acquire()
+        try:
+            if not self.done():
+                self._callbacks.append(fn)
+                return
+        finally:
+            self._cond.release()
+        fn(self)
+
+    def _wait(self, timeout):
+        self._cond.acquire()
+        try:
+            if not self.done():
+                self._cond.wait(timeout)
+            if not self.done():
+                raise RuntimeError("Timed out waiting for result")
+        finally:
+            self._cond.release()
+
+    def exception(self, timeout=None):
+        self._wait(timeout)
+        if self.cancelled():
+            raise CancelledError()
+        return self._exc_info and self._exc_info[1]
+
+    def result(self, timeout=None):
+        """Wait for and return the result, raising if the call failed."""
+        self._wait(timeout)
+        if self.cancelled():
+            raise CancelledError()
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+def resolved(value):
+    """A Future that already has the given result."""
+    f = Future()
+    f.set_result(value)
+    return f
+
+def chain(future, fn):
+    """A Future for fn(future.result()).
+
+    fn may itself return a Future, whose result is then used."""
+    rv = Future()
+
+    def resolve(f):
+        try:
+            v = fn(f.result())
+        except Exception:
+            rv.set_exception()
+            return
+        if isinstance(v, Future):
+            v.add_done_callback(lambda g: _copy(g, rv))
+        else:
+            rv.set_result(v)
+
+    future.add_done_callback(resolve)
+    return rv
+
+def _copy(src, dest):
+    try:
+        dest.set_result(src.result())
+    except Exception:
+        dest.set_exception()
+
+def gather(futures):
+    """A Future for the list of results of all the given futures.
+
+    Fails with the first failure encountered."""
+    futures = list(futures)
+    rv = Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def one(f):
+        lock.acquire()
+        try:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        finally:
+            lock.release()
+        if f.cancelled() or f.exception():
+            _copy(f, rv)
+        elif last:
+            rv.set_result([g.result() for g in futures])
+
+    if not futures:
+        rv.set_result([])
+    for f in futures:
+        f.add_done_callback(one)
+    return rv
+
+class WorkerPool(object):
+    """Run calls on at most size background threads."""
+
+    def __init__(self, size=10):
+        self.size = size
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            f, fn, args, kwargs = item
+            if not f.start():
+                continue
+            try:
+                f.set_result(fn(*args, **kwargs))
+            except Exception:
+                f.set_exception()
+
+    def submit(self, fn, *args, **kwargs):
+        """Schedule fn(*args, **kwargs), returning its Future."""
+        f = Future()
+        self._lock.acquire()
+        try:
+            if len(self._threads) < self.size:
+                t = threading.Thread(target=self._work)
+                t.daemon = True
+                t.start()
+                self._threads.append(t)
+        finally:
+            self._lock.release()
+        self._queue.put((f, fn, args, kwargs))
+        return f
+
+    def map(self, fn, *iterables):
+        """Submit fn for each set of arguments, returning the futures."""
+        return [self.submit(fn, *a) for a in zip(*iterables)]
+
+    def shutdown(self, wait=True):
+        """Stop the workers once the queued calls are done."""
+        self._lock.acquire()
+        try:
+            threads, self._threads = self._threads, []
+        finally:
+            self._lock.release()
+        for t in threads:
+            self._queue.put(None)
+        if wait:
+            for t in threads:
+                t.join()
+
+class SingleFlight(object):
+    """Share one execution among concurrent identical calls.
+
+    While a call for a key is running, further calls for the same key
+    wait for it and get its result (or exception) instead of running
+    again."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args):
+        self._lock.acquire()
+        try:
+            f = self._calls.get(key)
+            leader = f is None
+            if leader:
+                f = self._calls[key] = Future()
+        finally:
+            self._lock.release()
+
+        if leader:
+            try:
+                rv = fn(*args)
+            except BaseException:
+                # Even KeyboardInterrupt and the like must free the key,
+                # or later identical calls would wait forever.
+                exc_info = sys.exc_info()
+                self._forget(key)
+                f.set_exception(exc_info)
+            else:
+                self._forget(key)
+                f.set_result(rv)
+        return f.result()
+
+    def _forget(self, key):
+        self._lock.acquire()
+        try:
+            del self._calls[key]
+        finally:
+            self._lock.release()